@@ -0,0 +1,50 @@
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+
+def hour_bucket(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class PageViewBuffer(object):
+    """Counts page views in memory and hands them to ``flush`` in batches.
+
+    ``record`` only bumps a counter under a lock; the write happens on a background thread once
+    ``max_keys`` distinct (entity, hour) keys are pending or ``interval`` seconds have passed.
+    """
+
+    def __init__(self, flush, max_keys=1000, interval=30):
+        self._flush = flush
+        self.max_keys = max_keys
+        self.interval = interval
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._flushing = False
+
+    def record(self, entity_type, entity_id):
+        key = (entity_type, entity_id, hour_bucket(datetime.now()))
+        with self._lock:
+            self._counts[key] += 1
+            due = not self._flushing and (len(self._counts) >= self.max_keys or
+                                          time.monotonic() - self._last_flush >= self.interval)
+            if due:
+                self._flushing = True
+        if due:
+            threading.Thread(target=self.flush, daemon=True).start()
+
+    def drain(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._last_flush = time.monotonic()
+        return counts
+
+    def flush(self):
+        try:
+            counts = self.drain()
+            if counts:
+                self._flush(counts)
+        finally:
+            self._flushing = False
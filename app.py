@@ -2,18 +2,52 @@
 # Imports
 # ----------------------------------------------------------------------------#
 
+import atexit
+import heapq
+import hmac
+import itertools
+import json
 import logging
+import math
+import mimetypes
+import os
+import random
+import sqlite3
+import time
+import traceback
+import uuid
+from collections import Counter, deque
+from datetime import datetime, timedelta
 from logging import Formatter, FileHandler
 
 import babel
+import click
 import dateutil.parser
-from flask import Flask, render_template, request, flash, redirect, url_for
+from flask import Flask, render_template, request, flash, redirect, url_for, jsonify, send_from_directory, \
+    send_file, abort, Response, stream_with_context, g, has_request_context, get_flashed_messages
+from flask.cli import AppGroup
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, BaseQuery
 from flask_migrate import Migrate
-from sqlalchemy import PickleType
-
+from sqlalchemy import PickleType, TypeDecorator, event, func, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.pool import Pool
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import assets
+import snapshot
+from analytics import PageViewBuffer
+from caching import ttl_cache
 from forms import *
+from images import ThumbnailCache
+from loadshed import ConcurrencyLimiter
+from metrics import RollingLatency
+from ratelimit import MemoryStore, RateLimiter, SqliteStore
+from sharding import ShardRouter
 
 # ----------------------------------------------------------------------------#
 # App Config.
@@ -23,6 +57,8 @@ app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if app.config['TRUSTED_PROXY_COUNT']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
@@ -31,8 +67,44 @@ migrate = Migrate(app, db)
 # Models.
 # ----------------------------------------------------------------------------#
 
-class Venue(db.Model):
+class CommaSeparated(TypeDecorator):
+    """A list of strings kept comma-joined in a string column, as ``snapshot.generate`` writes it."""
+    impl = db.String
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        return ','.join(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return [item for item in value.split(',') if item]
+
+
+class SoftDeleteMixin(object):
+    """Rows are flagged with ``deleted_at`` and hard-deleted later by ``flask purge-deleted``."""
+    deleted_at = db.Column(db.DateTime, nullable=True)
+
+    @classmethod
+    def active(cls, session=None):
+        query = session.query(cls) if session is not None else cls.query
+        return query.filter(cls.deleted_at.is_(None))
+
+    def soft_delete(self):
+        self.deleted_at = datetime.now()
+
+
+class Venue(SoftDeleteMixin, db.Model):
     __tablename__ = 'venues'
+    __table_args__ = (
+        db.Index('ix_venues_active_city_state', 'city', 'state',
+                 postgresql_where=text('deleted_at IS NULL'), sqlite_where=text('deleted_at IS NULL')),
+        db.Index('ix_venues_active_name', 'name',
+                 postgresql_where=text('deleted_at IS NULL'), sqlite_where=text('deleted_at IS NULL')),
+        db.Index('ix_venues_deleted_at', 'deleted_at',
+                 postgresql_where=text('deleted_at IS NOT NULL'), sqlite_where=text('deleted_at IS NOT NULL')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -46,38 +118,127 @@ class Venue(db.Model):
     image_link = db.Column(db.String(500))
     website = db.Column(db.String())
     facebook_link = db.Column(db.String(120))
+    version_id = db.Column(db.Integer, nullable=False)
 
     shows = db.relationship('Show', backref='venue', lazy=True)
 
+    __mapper_args__ = {'version_id_col': version_id}
 
-class Artist(db.Model):
+
+class Artist(SoftDeleteMixin, db.Model):
     __tablename__ = 'artists'
+    __table_args__ = (
+        db.Index('ix_artists_active_name', 'name',
+                 postgresql_where=text('deleted_at IS NULL'), sqlite_where=text('deleted_at IS NULL')),
+        db.Index('ix_artists_deleted_at', 'deleted_at',
+                 postgresql_where=text('deleted_at IS NOT NULL'), sqlite_where=text('deleted_at IS NOT NULL')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.Column(CommaSeparated(120))
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(500))
     image_link = db.Column(db.String(500))
     website = db.Column(db.String())
     facebook_link = db.Column(db.String(120))
+    version_id = db.Column(db.Integer, nullable=False)
 
     shows = db.relationship('Show', backref='artist', lazy=True)
 
+    __mapper_args__ = {'version_id_col': version_id}
+
 
 class Show(db.Model):
     __tablename__ = 'shows'
 
     id = db.Column(db.Integer, primary_key=True)
 
-    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id'))
-    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id'))
+    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id'), index=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id'), index=True)
     start_time = db.Column(db.DateTime, nullable=False)
 
 
+class VenueShard(db.Model):
+    """Directory of which shard holds each venue; also hands out venue ids unique across shards."""
+    __tablename__ = 'venue_shards'
+
+    venue_id = db.Column(db.Integer, primary_key=True)
+    shard = db.Column(db.String(32), nullable=False)
+
+
+class ShowId(db.Model):
+    """Hands out show ids unique across shards; the shows themselves live on their venue's shard."""
+    __tablename__ = 'show_ids'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+
+class ArchivedShow(db.Model):
+    """Past shows moved out of `shows` by `flask shows archive`; ``show_history`` reads both tables."""
+    __tablename__ = 'shows_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id'), index=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id'), index=True)
+    start_time = db.Column(db.DateTime, nullable=False)
+
+
+def show_history(key, entity_id, before):
+    """Shows of one venue or artist (``key`` is 'venue_id' or 'artist_id') that started before ``before``."""
+    columns = ('venue_id', 'artist_id', 'start_time')
+    live = db.select([getattr(Show, column) for column in columns]) \
+        .where(db.and_(getattr(Show, key) == entity_id, Show.start_time < before))
+    archived = db.select([getattr(ArchivedShow, column) for column in columns]) \
+        .where(db.and_(getattr(ArchivedShow, key) == entity_id, ArchivedShow.start_time < before))
+    return db.union_all(live, archived).alias('show_history')
+
+
+class Change(db.Model):
+    """Append-only log of catalog writes, committed together with the write itself.
+
+    ``position`` is the feed order, assigned after commit by ``sequence_changes``.
+    """
+    __tablename__ = 'changes'
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    position = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), unique=True, index=True)
+    entity_type = db.Column(db.String(16), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(8), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "position": self.position,
+            "entity_type": self.entity_type,
+            "entity_id": self.entity_id,
+            "op": self.op,
+            "data": json.loads(self.payload),
+            "created_at": self.created_at.isoformat(),
+        }
+
+
+class PageViewCount(db.Model):
+    """Page views per venue/artist, bucketed by hour and rolled up by day."""
+    __tablename__ = 'page_view_counts'
+    __table_args__ = (
+        db.Index('ix_page_view_counts_granularity_bucket', 'granularity', 'bucket_start'),
+    )
+
+    entity_type = db.Column(db.String(16), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(8), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    views = db.Column(db.Integer, nullable=False, default=0)
+
+
 # ----------------------------------------------------------------------------#
 # Filters.
 # ----------------------------------------------------------------------------#
@@ -94,69 +255,741 @@ def format_datetime(value, format='medium'):
 app.jinja_env.filters['datetime'] = format_datetime
 
 
+# ----------------------------------------------------------------------------#
+# Streaming.
+# ----------------------------------------------------------------------------#
+
+def streamed(query):
+    """Iterate a query over a server-side cursor in LISTING_BATCH_SIZE chunks."""
+    return query.execution_options(stream_results=True).yield_per(app.config['LISTING_BATCH_SIZE'])
+
+
+def render_listing(template_name, **context):
+    """Render a listing page, streaming it to the client as it is generated when STREAM_LISTINGS is on.
+
+    ``context`` may hold generators; they are consumed lazily while the template renders.
+    """
+    if not app.config['STREAM_LISTINGS']:
+        return render_template(template_name, **context)
+
+    # The session cookie is written before the body streams, so pop the flashed messages now;
+    # the layout's get_flashed_messages() call then reads them from the request's cache.
+    get_flashed_messages()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(app.config['STREAM_BUFFER_SIZE'])
+    return Response(stream_with_context(stream))
+
+
+# ----------------------------------------------------------------------------#
+# Static assets.
+# ----------------------------------------------------------------------------#
+
+asset_manifest = assets.load_manifest(app.static_folder)
+
+
+@app.context_processor
+def inject_asset_urls():
+    def asset_urls(bundle):
+        # Unbuilt trees (local dev) fall back to the individual source files.
+        if bundle in asset_manifest:
+            return [url_for('dist', filename=asset_manifest[bundle])]
+        return [url_for('static', filename=source) for source in assets.BUNDLES[bundle]]
+
+    return dict(asset_urls=asset_urls)
+
+
+@app.route('/static/dist/<path:filename>')
+def dist(filename):
+    directory = os.path.join(app.static_folder, assets.DIST_DIR)
+    mimetype = mimetypes.guess_type(filename)[0]
+
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encoding in request.accept_encodings and os.path.isfile(os.path.join(directory, filename + suffix)):
+            response = send_from_directory(directory, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(directory, filename, mimetype=mimetype)
+
+    # Filenames change with their content, so clients never need to revalidate.
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Bundle, minify and fingerprint CSS/JS into static/dist."""
+    for bundle, filename in sorted(assets.build(app.static_folder).items()):
+        click.echo('{} -> {}'.format(bundle, filename))
+
+
+# ----------------------------------------------------------------------------#
+# Sharding.
+# ----------------------------------------------------------------------------#
+
+shards = ShardRouter(db.session, app.config['SHARDS'], app.config['SHARD_BY_STATE'],
+                     default=app.config['SHARD_DEFAULT'], query_cls=BaseQuery,
+                     execution_options=lambda: {'statement_timeout': statement_timeout()})
+
+
+@app.teardown_appcontext
+def remove_shard_sessions(error=None):
+    shards.remove()
+
+
+@ttl_cache(app.config['SHARD_DIRECTORY_CACHE_SECONDS'], maxsize=app.config['SHARD_DIRECTORY_CACHE_SIZE'],
+           cache_none=False)
+def venue_shard(venue_id):
+    return db.session.query(VenueShard.shard).filter_by(venue_id=venue_id).scalar()
+
+
+def venue_session(venue_id):
+    """Session for the database holding ``venue_id`` and its shows; aborts with 404 for unknown venues."""
+    if not shards.enabled:
+        return db.session
+    shard = venue_shard(venue_id)
+    if shard is None:
+        abort(404)
+    return shards.session(shard)
+
+
+def allocate_venue_id(shard):
+    entry = VenueShard(shard=shard)
+    db.session.add(entry)
+    db.session.flush()
+    return entry.venue_id
+
+
+def allocate_show_id():
+    # Shard-local ids would repeat across shards, and the change feed identifies shows by id.
+    entry = ShowId()
+    db.session.add(entry)
+    db.session.flush()
+    return entry.id
+
+
+def commit(session):
+    """Commit ``session`` and, for a shard session, the primary holding the directory and change log.
+
+    The two commits are not atomic: a failure in between leaves the shard row without its log entry.
+    """
+    session.commit()
+    if session is not db.session:
+        db.session.commit()
+
+
+def rollback(session):
+    session.rollback()
+    if session is not db.session:
+        db.session.rollback()
+
+
+def replicate_artist(artist):
+    # Shards keep a reference copy of every artist so show queries can join locally.
+    row = {column.key: getattr(artist, column.key) for column in Artist.__table__.columns}
+    try:
+        shards.replicate(Artist.__table__, row)
+    except SQLAlchemyError:
+        app.logger.exception('Could not replicate artist %s to the shards', row['id'])
+
+
+def listing_rows(build_query, key):
+    """Rows of ``build_query(session)`` from every shard, merged in ``key`` order.
+
+    Unsharded, this is the query itself, read through a server-side cursor.
+    """
+    if not shards.enabled:
+        return streamed(build_query(db.session))
+    return merged_rows(build_query, key)
+
+
+def merged_rows(build_query, key):
+    # A generator, so the fan-out only starts once the caller iterates (see stale_fallback).
+    # Each shard streams its rows in order, so heapq.merge only holds a few batches per shard.
+    streams = shards.stream(lambda session: streamed(build_query(session)), app.config['LISTING_BATCH_SIZE'])
+    try:
+        for row in heapq.merge(*streams, key=key):
+            yield row
+    finally:
+        for stream in streams:
+            stream.close()
+
+
+@app.cli.command('init-shards')
+def init_shards():
+    """Create the schema on every shard and copy all artists to them."""
+    if not shards.enabled:
+        raise click.ClickException('No SHARDS configured.')
+    shards.create_all(db.metadata)
+    artists = Artist.query.all()
+    for artist in artists:
+        replicate_artist(artist)
+    click.echo('Initialized {} shards with {} artists'.format(len(shards.engines), len(artists)))
+
+
+# ----------------------------------------------------------------------------#
+# Change feed.
+# ----------------------------------------------------------------------------#
+
+def serialize(entity):
+    data = {}
+    for column in entity.__table__.columns:
+        value = getattr(entity, column.key)
+        data[column.key] = value.isoformat() if isinstance(value, datetime) else value
+    return data
+
+
+def record_change(entity, op, session=None):
+    """Queue a change-log row for ``entity`` in the current transaction; the caller commits both.
+
+    ``session`` is where ``entity`` lives; the log itself is always kept on the primary.
+    """
+    (session or db.session).flush()
+    db.session.add(Change(entity_type=type(entity).__name__.lower(), entity_id=entity.id, op=op,
+                          payload=json.dumps(serialize(entity))))
+
+
+CHANGE_SEQUENCER_LOCK = 0x66797975  # pg_advisory_xact_lock key, 'fyyu'
+
+
+def sequence_changes(batch_size):
+    """Give committed changes that have no ``position`` yet the next positions, in id order.
+
+    Ids are handed out at insert time but rows become visible at commit time, so a slow
+    transaction can commit a lower id after consumers have read past it. Positions are only
+    assigned to rows that are already committed, one sequencer at a time, so a late commit lands
+    after everything consumers have seen instead of behind their cursor.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': CHANGE_SEQUENCER_LOCK})
+    else:
+        # A write statement takes SQLite's database-wide write lock, even when it matches nothing.
+        db.session.execute(text('UPDATE changes SET position = position WHERE 1 = 0'))
+    pending = [change_id for (change_id,) in db.session.query(Change.id)
+               .filter(Change.position.is_(None)).order_by(Change.id).limit(batch_size)]
+    if pending:
+        last = db.session.query(func.max(Change.position)).scalar() or 0
+        db.session.execute(Change.__table__.update()
+                           .where(Change.id == db.bindparam('b_id'))
+                           .values(position=db.bindparam('b_position')),
+                           [{"b_id": change_id, "b_position": last + offset}
+                            for offset, change_id in enumerate(pending, 1)])
+    db.session.commit()
+
+
+def changes_since(position, limit):
+    """Changes after feed ``position``, oldest first.
+
+    Every committed change is delivered exactly once to a consumer that resumes from the last
+    position it processed, in commit order (which may differ from id order); ``position`` is
+    only the feed order, not a timestamp.
+    """
+    db.session.commit()
+    sequence_changes(app.config['CHANGE_FEED_MAX_LIMIT'])
+    return Change.query.filter(Change.position > position) \
+        .order_by(Change.position).limit(limit).all()
+
+
+# ----------------------------------------------------------------------------#
+# Edits.
+# ----------------------------------------------------------------------------#
+
+VENUE_EDITABLE_FIELDS = ('name', 'city', 'state', 'address', 'phone', 'genres', 'seeking_talent',
+                         'seeking_description', 'image_link', 'website', 'facebook_link')
+ARTIST_EDITABLE_FIELDS = ('name', 'city', 'state', 'phone', 'genres', 'seeking_venue',
+                          'seeking_description', 'image_link', 'website', 'facebook_link')
+
+
+def comparable(value):
+    # An empty input stands for a NULL column, and genres are a set whatever order they come in.
+    if value == '':
+        return None
+    if isinstance(value, (list, tuple)):
+        return sorted(value)
+    return value
+
+
+def changed_fields(entity, form, fields):
+    # The edit pages only render some of the columns; those missing from the POST keep their value.
+    return {field: (getattr(entity, field), getattr(form, field).data)
+            for field in fields if getattr(form, field).raw_data
+            and comparable(getattr(entity, field)) != comparable(getattr(form, field).data)}
+
+
+def apply_edit(entity, form, fields, session=None):
+    """Write only the changed fields, provided the row is still at the version the form was rendered with.
+
+    Returns the ``{field: (current, submitted)}`` diff when another editor got there first, otherwise None.
+    """
+    session = session or db.session
+    if form.version.data != str(entity.version_id):
+        return changed_fields(entity, form, fields)
+
+    changes = changed_fields(entity, form, fields)
+    if not changes:
+        return None
+
+    for field, (_, submitted) in changes.items():
+        setattr(entity, field, submitted)
+    try:
+        # version_id_col makes this UPDATE ... WHERE id = ? AND version_id = ?
+        record_change(entity, 'update', session)
+        commit(session)
+    except StaleDataError:
+        rollback(session)
+        return changed_fields(entity, form, fields)
+    return None
+
+
+# ----------------------------------------------------------------------------#
+# Analytics.
+# ----------------------------------------------------------------------------#
+
+def write_page_views(counts):
+    table = PageViewCount.__table__
+    # Sorted so concurrent flushes from several workers lock rows in the same order.
+    rows = [{"entity_type": entity_type, "entity_id": entity_id, "granularity": 'hour',
+             "bucket_start": bucket_start, "views": views}
+            for (entity_type, entity_id, bucket_start), views in sorted(counts.items())]
+    with app.app_context():
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                insert = postgresql.insert(table).values(rows)
+                db.session.execute(insert.on_conflict_do_update(
+                    index_elements=[table.c.entity_type, table.c.entity_id, table.c.granularity,
+                                    table.c.bucket_start],
+                    set_={"views": table.c.views + insert.excluded.views}))
+            else:
+                # Another worker may create the same (entity, hour) row at any moment, so make sure it
+                # exists without failing and then add to it.
+                db.session.execute(table.insert().prefix_with('OR IGNORE'), [dict(row, views=0) for row in rows])
+                db.session.execute(
+                    table.update()
+                    .where(db.and_(table.c.entity_type == db.bindparam('b_entity_type'),
+                                   table.c.entity_id == db.bindparam('b_entity_id'),
+                                   table.c.granularity == db.bindparam('b_granularity'),
+                                   table.c.bucket_start == db.bindparam('b_bucket_start')))
+                    .values(views=table.c.views + db.bindparam('b_views')),
+                    [{'b_' + key: value for key, value in row.items()} for row in rows])
+            db.session.commit()
+        except SQLAlchemyError:
+            app.logger.exception('Could not write %d page view counters', len(counts))
+            db.session.rollback()
+
+
+page_views = PageViewBuffer(write_page_views,
+                            max_keys=app.config['PAGE_VIEW_FLUSH_SIZE'],
+                            interval=app.config['PAGE_VIEW_FLUSH_INTERVAL'])
+atexit.register(page_views.flush)
+
+
+@ttl_cache(app.config['TRENDING_CACHE_SECONDS'])
+def trending(model, entity_type):
+    since = datetime.now() - app.config['TRENDING_WINDOW']
+    totals = db.session.query(PageViewCount.entity_id, func.sum(PageViewCount.views).label('views')) \
+        .filter(PageViewCount.entity_type == entity_type,
+                PageViewCount.granularity == 'hour',
+                PageViewCount.bucket_start >= since) \
+        .group_by(PageViewCount.entity_id) \
+        .order_by(func.sum(PageViewCount.views).desc()) \
+        .limit(app.config['TRENDING_LIMIT']).all()
+
+    ids = [entity_id for entity_id, _ in totals]
+
+    def lookup(session):
+        return model.active(session).filter(model.id.in_(ids)).with_entities(model.id, model.name).all()
+
+    names = dict(itertools.chain.from_iterable(shards.fan_out(lookup) if model is Venue else [lookup(None)]))
+    return [{"id": entity_id, "name": names[entity_id], "views": views}
+            for entity_id, views in totals if entity_id in names]
+
+
+# ----------------------------------------------------------------------------#
+# Thumbnails.
+# ----------------------------------------------------------------------------#
+
+thumbnails = ThumbnailCache(app.config['IMAGE_CACHE_DIR'], app.config['IMAGE_SIZES'],
+                            app.config['IMAGE_CACHE_MAX_BYTES'],
+                            fetch_timeout=app.config['IMAGE_FETCH_TIMEOUT'],
+                            max_source_bytes=app.config['IMAGE_MAX_SOURCE_BYTES'])
+IMAGE_MODELS = {'venue': Venue, 'artist': Artist}
+
+
+@app.context_processor
+def inject_thumbnail_url():
+    def thumbnail_url(kind, entity_id, version, size='thumb'):
+        # The row version makes the URL change whenever image_link may have changed.
+        return url_for('image', kind=kind, entity_id=entity_id, size=size, v=version)
+
+    return dict(thumbnail_url=thumbnail_url)
+
+
+@app.route('/img/<kind>/<int:entity_id>/<size>')
+def image(kind, entity_id, size):
+    if kind not in IMAGE_MODELS or size not in thumbnails.sizes:
+        abort(404)
+    version = request.args.get('v', type=int)
+    fmt = 'webp' if request.accept_mimetypes['image/webp'] else 'jpeg'
+
+    path = version is not None and thumbnails.get(kind, entity_id, version, size, fmt)
+    if path:
+        response = send_file(path, mimetype='image/' + fmt, conditional=True)
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        response.vary.add('Accept')
+        return response
+
+    # Hits above skip load shedding and rate limits; a miss queries the database, so it doesn't.
+    rejected = rate_limited('image') or admit(in_flight)
+    if rejected:
+        return rejected
+
+    # Not generated yet (or cannot be): send the client to the original while it is built.
+    model = IMAGE_MODELS[kind]
+    session = venue_session(entity_id) if model is Venue else None
+    entity = model.active(session).filter_by(id=entity_id).first_or_404()
+    if not entity.image_link:
+        abort(404)
+    if not thumbnails.failed(kind, entity_id, entity.version_id):
+        thumbnails.submit(kind, entity_id, entity.version_id, entity.image_link)
+    return redirect(entity.image_link)
+
+
+# ----------------------------------------------------------------------------#
+# Request metrics.
+# ----------------------------------------------------------------------------#
+
+route_latency = RollingLatency(app.config['LATENCY_WINDOW'], app.config['LATENCY_WINDOW_SLOTS'])
+slow_requests = deque(maxlen=app.config['SLOW_REQUEST_KEEP'])
+
+
+def json_log(name, path):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if path:
+        handler = FileHandler(path)
+        handler.setFormatter(Formatter('%(message)s'))
+        logger.addHandler(handler)
+    return logger
+
+
+access_log = json_log('fyyur.access', app.config['ACCESS_LOG'])
+slow_log = json_log('fyyur.slow', app.config['SLOW_REQUEST_LOG'])
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID', '')[:64] or uuid.uuid4().hex
+    g.db_time = 0.0
+    g.db_queries = 0
+    # Only a sample of requests pays for recording statements, since slowness is known only at the end.
+    sampled = random.random() < app.config['SLOW_REQUEST_SAMPLE_RATE']
+    g.statements = [] if sampled else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    # Statements run on fan-out threads have no request context and are not counted.
+    if not has_request_context() or 'db_queries' not in g:
+        return
+    elapsed = time.perf_counter() - conn.info.pop('query_started', time.perf_counter())
+    g.db_time += elapsed
+    g.db_queries += 1
+    if g.statements is not None and len(g.statements) < app.config['SLOW_REQUEST_MAX_STATEMENTS']:
+        g.statements.append({"sql": statement, "ms": round(elapsed * 1000, 2), "stack": app_stack()})
+
+
+def app_stack():
+    """Frames of this application's own code leading to the current call, outermost first."""
+    return ['{}:{} in {}'.format(os.path.relpath(frame.filename, app.root_path), frame.lineno, frame.name)
+            for frame in traceback.extract_stack()[:-2]
+            if frame.filename.startswith(app.root_path) and 'site-packages' not in frame.filename]
+
+
+@app.after_request
+def log_request(response):
+    if 'request_started' not in g:
+        return response
+    response.headers['X-Request-ID'] = g.request_id
+    entry = {
+        "request_id": g.request_id,
+        "method": request.method,
+        "route": request.url_rule.rule if request.url_rule else None,
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "remote_addr": request.remote_addr,
+    }
+    stats = g._get_current_object()
+    if response.is_streamed:
+        # Listings do most of their work while the body is sent, so finish timing once it is.
+        response.call_on_close(lambda: finish_request(entry, stats))
+    else:
+        finish_request(entry, stats)
+    return response
+
+
+def finish_request(entry, stats):
+    latency = time.perf_counter() - stats.request_started
+    entry.update(latency_ms=round(latency * 1000, 2), db_ms=round(stats.db_time * 1000, 2),
+                 db_queries=stats.db_queries, time=datetime.now().isoformat())
+    if entry['endpoint']:
+        route_latency.record(entry['endpoint'], latency * 1000000)
+    access_log.info(json.dumps(entry))
+
+    if stats.statements is not None and entry['latency_ms'] >= app.config['SLOW_REQUEST_THRESHOLD']:
+        slow = dict(entry, statements=stats.statements)
+        slow_requests.appendleft(slow)
+        slow_log.info(json.dumps(slow))
+
+
+def admin_token_valid():
+    token = app.config['ADMIN_TOKEN']
+    auth = request.authorization
+    return auth is not None and hmac.compare_digest((auth.password or '').encode(), token.encode())
+
+
+@app.route('/admin/latency')
+def latency_dashboard():
+    # Behind a proxy on the same host every client is 127.0.0.1 unless TRUSTED_PROXY_COUNT is set,
+    # so the address check alone is not enough outside debug mode.
+    if request.remote_addr not in app.config['ADMIN_ALLOWED_IPS']:
+        abort(404)
+    if not app.config['ADMIN_TOKEN']:
+        if not app.debug:
+            abort(404)
+    elif not admin_token_valid():
+        return Response('Authentication required', 401, {'WWW-Authenticate': 'Basic realm="fyyur admin"'})
+    return render_template('pages/latency.html', routes=sorted(route_latency.summary().items()),
+                           slow_requests=list(slow_requests), window=app.config['LATENCY_WINDOW'],
+                           threshold=app.config['SLOW_REQUEST_THRESHOLD'])
+
+
+# ----------------------------------------------------------------------------#
+# Timeouts and load shedding.
+# ----------------------------------------------------------------------------#
+
+DATABASE_UNAVAILABLE = (OperationalError, PoolTimeoutError)
+
+in_flight = ConcurrencyLimiter(app.config['MAX_IN_FLIGHT_REQUESTS'])
+open_streams = ConcurrencyLimiter(app.config['MAX_CHANGE_STREAMS'])
+stale_listings = {}
+
+
+def statement_timeout(conn=None):
+    """Milliseconds each statement of the current request may run; None outside requests.
+
+    Shard connections opened by ``shards.fan_out`` on worker threads carry the timeout of the
+    request that started them as the ``statement_timeout`` execution option.
+    """
+    if conn is not None and 'statement_timeout' in conn.get_execution_options():
+        return conn.get_execution_options()['statement_timeout']
+    if not has_request_context():
+        return None
+    return app.config['STATEMENT_TIMEOUTS'].get(request.endpoint, app.config['DEFAULT_STATEMENT_TIMEOUT'])
+
+
+@event.listens_for(Pool, 'connect')
+def install_sqlite_deadline(dbapi_connection, connection_record):
+    # SQLite has no statement_timeout; the progress handler aborts the running statement
+    # ("interrupted") once the deadline set in enforce_statement_timeout has passed.
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        info = connection_record.info
+        dbapi_connection.set_progress_handler(lambda: info.get('deadline', math.inf) < time.monotonic(), 1000)
+
+
+@event.listens_for(Engine, 'begin')
+def set_postgresql_statement_timeout(conn):
+    timeout = statement_timeout(conn)
+    if timeout and conn.dialect.name == 'postgresql':
+        conn.execute(text('SET LOCAL statement_timeout = {:d}'.format(timeout)))
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def enforce_statement_timeout(conn, cursor, statement, parameters, context, executemany):
+    timeout = statement_timeout(conn)
+    if conn.dialect.name == 'sqlite':
+        conn.info['deadline'] = time.monotonic() + timeout / 1000.0 if timeout else math.inf
+
+    latency = app.config['DB_INJECTED_LATENCY']
+    if latency:
+        # Local stand-in for a slow database: stall, and fail the way a statement timeout would.
+        time.sleep(min(latency, timeout or latency) / 1000.0)
+        if timeout and latency > timeout:
+            raise OperationalError(statement, parameters, Exception('canceling statement due to statement timeout'))
+
+
+def stale_fallback(name, rows):
+    """Serve the query ``rows`` while keeping a copy as the fallback for when the database is unavailable.
+
+    Returns ``(rows, stale)``; ``stale`` is True when the last complete copy is served instead.
+    Pass the query itself, not a generator built over it: the query only runs once iterated here.
+    """
+    try:
+        rows = iter(rows)
+        first = next(rows, stale_fallback)
+    except DATABASE_UNAVAILABLE:
+        db.session.rollback()
+        if name not in stale_listings:
+            raise
+        app.logger.warning('Database unavailable, serving the cached %s listing', name)
+        return stale_listings[name], True
+
+    return record_listing(name, [] if first is stale_fallback else [first], rows), False
+
+
+def record_listing(name, head, rows):
+    copy = []
+    for row in itertools.chain(head, rows):
+        if copy is not None:
+            copy.append(row)
+            if len(copy) > app.config['STALE_LISTING_MAX_ROWS']:
+                copy = None
+        yield row
+    if copy is not None:
+        stale_listings[name] = copy
+
+
+def admit(limiter):
+    """Hold a slot of ``limiter`` until the request ends; returns a 503 response when there is none."""
+    if not limiter.try_acquire():
+        return render_template('errors/503.html'), 503, {'Retry-After': '1'}
+    g.admitted = limiter
+
+
+@app.before_request
+def shed_load():
+    if request.endpoint in app.config['LOAD_SHED_EXEMPT']:
+        return None
+    return admit(open_streams if request.endpoint == 'change_stream' else in_flight)
+
+
+@app.teardown_request
+def release_slot(error=None):
+    # Streamed responses keep their request context, so this runs once the stream has ended.
+    limiter = g.pop('admitted', None)
+    if limiter is not None:
+        limiter.release()
+
+
+@app.route('/metrics/load')
+def load_metrics():
+    return jsonify(dict(in_flight.stats(), change_streams=open_streams.stats()))
+
+
+@app.errorhandler(OperationalError)
+@app.errorhandler(PoolTimeoutError)
+def database_unavailable(error):
+    db.session.rollback()
+    app.logger.warning('Database unavailable: %s', error)
+    return render_template('errors/503.html'), 503, {'Retry-After': '5'}
+
+
+# ----------------------------------------------------------------------------#
+# Rate limiting.
+# ----------------------------------------------------------------------------#
+
+rate_limiter = RateLimiter(app.config['RATELIMITS'],
+                           SqliteStore(app.config['RATELIMIT_STORAGE']) if app.config['RATELIMIT_STORAGE']
+                           else MemoryStore())
+
+
+def rate_limited(key):
+    """A 429 response when the client is out of tokens for the RATELIMITS entry ``key``, else None."""
+    try:
+        retry_after = rate_limiter.check(key, request.remote_addr)
+    except sqlite3.Error:
+        app.logger.exception('Rate limit store unavailable, letting the request through')
+        return None
+
+    if retry_after:
+        response = app.make_response((render_template('errors/429.html'), 429))
+        response.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+        return response
+
+
+@app.before_request
+def throttle():
+    # image() throttles its cache misses itself; hits are served from disk.
+    if request.endpoint == 'image':
+        return None
+    return rate_limited(request.endpoint)
+
+
+@app.route('/metrics/ratelimit')
+def ratelimit_metrics():
+    return jsonify(rate_limiter.stats())
+
+
 # ----------------------------------------------------------------------------#
 # Controllers.
 # ----------------------------------------------------------------------------#
 
 @app.route('/')
 def index():
-    return render_template('pages/home.html')
+    return render_template('pages/home.html',
+                           trending_venues=trending(Venue, 'venue'),
+                           trending_artists=trending(Artist, 'artist'))
 
 
 #  Venues
 #  ----------------------------------------------------------------
 
+def venues_with_upcoming_counts(session):
+    upcoming = session.query(Show.venue_id, func.count(Show.id).label('num_upcoming_shows')) \
+        .join(Artist) \
+        .filter(Show.start_time > datetime.now(), Artist.deleted_at.is_(None)) \
+        .group_by(Show.venue_id).subquery()
+
+    return Venue.active(session) \
+        .outerjoin(upcoming, upcoming.c.venue_id == Venue.id) \
+        .with_entities(Venue.id, Venue.name, Venue.city, Venue.state,
+                       func.coalesce(upcoming.c.num_upcoming_shows, 0).label('num_upcoming_shows'))
+
+
+def venue_listing(session):
+    # Ordered like ix_venues_active_city_state so each area is one contiguous run of rows.
+    return venues_with_upcoming_counts(session).order_by(Venue.city, Venue.state, Venue.id)
+
+
 @app.route('/venues')
 def venues():
-    all_venues = Venue.query.all()
-    data = []
-    locations = []
-    current_date = datetime.now()
+    rows, stale = stale_fallback('venues', listing_rows(venue_listing, key=lambda row: (row.city, row.state, row.id)))
 
-    for venue in all_venues:
-        num_upcoming_shows = Show.query.filter_by(venue_id=venue.id).filter(Show.start_time > current_date).all()
-        location = {
-            "city": venue.city,
-            "state": venue.state
-        }
+    areas = ({
+        "city": city,
+        "state": state,
+        "venues": [{
+            "id": venue.id,
+            "name": venue.name,
+            "num_upcoming_shows": venue.num_upcoming_shows
+        } for venue in area_venues]
+    } for (city, state), area_venues in itertools.groupby(rows, key=lambda row: (row.city, row.state)))
 
-        if location not in locations:
-            locations.append(location)
-            venue_data = {
-                "venues": [{
-                    "id": venue.id,
-                    "name": venue.name,
-                    "num_upcoming_shows": len(num_upcoming_shows)
-                }]
-            }
-            data.append(dict(list(location.items()) + list(venue_data.items())))
-
-        else:
-            for dt in data:
-                if dt.get('city') == venue.city and dt.get('state') == venue.state:
-                    dt['venues'].append({
-                        "id": venue.id,
-                        "name": venue.name,
-                        "num_upcoming_shows": len(num_upcoming_shows)
-                    })
-
-    return render_template('pages/venues.html', areas=data);
+    return render_listing('pages/venues.html', areas=areas, stale=stale)
 
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
     search_str = request.form.get('search_term')
-    search_query = Venue.query.filter(Venue.name.ilike('%{}%'.format(search_str))).all()
+    search_query = sorted(itertools.chain.from_iterable(shards.fan_out(
+        lambda session: venues_with_upcoming_counts(session)
+        .filter(Venue.name.ilike('%{}%'.format(search_str))).all())), key=lambda row: row.id)
 
     data = []
-    current_date = datetime.now()
 
     for venue in search_query:
-        num_upcoming_shows = Show.query.filter_by(venue_id=venue.id).filter(Show.start_time > current_date).all()
         data_object = {
             "id": venue.id,
             "name": venue.name,
-            "num_upcoming_shows": num_upcoming_shows,
+            "num_upcoming_shows": venue.num_upcoming_shows,
         }
 
         data.append(data_object)
@@ -174,31 +1007,40 @@ def search_venues():
 def show_venue(venue_id):
     current_date = datetime.now()
 
-    venue = Venue.query.get(venue_id)
+    session = venue_session(venue_id)
+    venue = Venue.active(session).filter_by(id=venue_id).first_or_404()
+    page_views.record('venue', venue_id)
+    venue_shows = session.query(Show).join(Artist).filter(Show.venue_id == venue_id, Artist.deleted_at.is_(None))
 
-    past_shows = Show.query.filter_by(venue_id=venue_id).filter(Show.start_time < current_date).all()
+    history = show_history('venue_id', venue_id, current_date)
+    past_shows = session.query(history.c.artist_id, history.c.start_time, Artist) \
+        .join(Artist, Artist.id == history.c.artist_id) \
+        .filter(Artist.deleted_at.is_(None)) \
+        .order_by(history.c.start_time).all()
     past_shows_data = []
 
     for past in past_shows:
-        artist_show = Artist.query.get(past.artist_id)
+        artist_show = past.Artist
         past_show_obj = {
             "artist_id": past.artist_id,
             "artist_name": artist_show.name,
             "artist_image_link": artist_show.image_link,
+            "artist_version": artist_show.version_id,
             "start_time": past.start_time
         }
 
         past_shows_data.append(past_show_obj)
 
-    upcoming_shows = Show.query.filter_by(venue_id=venue_id).filter(Show.start_time > current_date).all()
+    upcoming_shows = venue_shows.filter(Show.start_time > current_date).all()
     upcoming_shows_data = []
 
     for upcoming in upcoming_shows:
-        artist_show = Artist.query.get(upcoming.artist_id)
+        artist_show = upcoming.artist
         upcoming_show_obj = {
             "artist_id": upcoming.artist_id,
             "artist_name": artist_show.name,
             "artist_image_link": artist_show.image_link,
+            "artist_version": artist_show.version_id,
             "start_time": upcoming.start_time
         }
 
@@ -217,6 +1059,7 @@ def show_venue(venue_id):
         "seeking_talent": venue.seeking_talent,
         "seeking_description": venue.seeking_description,
         "image_link": venue.image_link,
+        "version": venue.version_id,
         "past_shows": past_shows_data,
         "upcoming_shows": upcoming_shows_data,
         "past_shows_count": len(past_shows_data),
@@ -239,6 +1082,11 @@ def create_venue_form():
 def create_venue_submission():
     form = VenueForm()
     if form.validate():
+        shard = shards.shard_for_state(form.state.data)
+        if shards.enabled and shard is None:
+            flash('Venues in ' + form.state.data + ' cannot be listed yet.')
+            return render_template('forms/new_venue.html', form=form)
+        session = shards.session(shard)
         try:
             new_venue = Venue(name=form.name.data,
                               genres=form.genres.data,
@@ -252,13 +1100,19 @@ def create_venue_submission():
                               website=form.website.data,
                               facebook_link=form.facebook_link.data
                               )
-            db.session.add(new_venue)
-            db.session.commit()
+            if shards.enabled:
+                new_venue.id = allocate_venue_id(shard)
+            session.add(new_venue)
+            record_change(new_venue, 'create', session)
+            commit(session)
+            entities_changed()
+            thumbnails.submit('venue', new_venue.id, new_venue.version_id, new_venue.image_link)
             flash('Venue ' + request.form['name'] + ' was successfully listed!')
         except:
             flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
-            db.session.rollback()
+            rollback(session)
         finally:
+            session.close()
             db.session.close()
     else:
         flash('There is a form error')
@@ -269,12 +1123,22 @@ def create_venue_submission():
 
 @app.route('/venues/<int:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
+    session = venue_session(venue_id)
+    venue = Venue.active(session).filter_by(id=venue_id).first_or_404()
+    venue_name = venue.name
+
     try:
-        Venue.query.filter_by(id=venue_id).delete()
-        db.session.commit()
-    except:
-        db.session.rollback()
+        venue.soft_delete()
+        record_change(venue, 'delete', session)
+        commit(session)
+        entities_changed()
+        flash('Venue ' + venue_name + ' was successfully deleted!')
+    except SQLAlchemyError:
+        app.logger.exception('Could not delete venue %s', venue_id)
+        flash('An error occurred. Venue ' + venue_name + ' could not be deleted.')
+        rollback(session)
     finally:
+        session.close()
         db.session.close()
 
     return redirect(url_for('index'))
@@ -284,34 +1148,39 @@ def delete_venue(venue_id):
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-    artists_query = Artist.query.all()
-    data = []
+    rows, stale = stale_fallback('artists', streamed(
+        Artist.active().with_entities(Artist.id, Artist.name).order_by(Artist.id)))
 
-    for artist in artists_query:
-        artist_data = {
-            "id": artist.id,
-            "name": artist.name
-        }
-        data.append(artist_data)
+    data = ({
+        "id": artist.id,
+        "name": artist.name
+    } for artist in rows)
 
-    return render_template('pages/artists.html', artists=data)
+    return render_listing('pages/artists.html', artists=data, stale=stale)
 
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
     search_str = request.form.get('search_term')
-    search_query = Artist.query.filter(Artist.name.ilike('%{}%'.format(search_str))).all()
+    search_query = Artist.active().filter(Artist.name.ilike('%{}%'.format(search_str))).all()
 
     current_date = datetime.now()
+    artist_ids = [artist.id for artist in search_query]
+    upcoming = Counter()
+    for counts in shards.fan_out(
+            lambda session: session.query(Show.artist_id, func.count(Show.id))
+            .join(Venue)
+            .filter(Show.artist_id.in_(artist_ids), Show.start_time > current_date, Venue.deleted_at.is_(None))
+            .group_by(Show.artist_id).all()):
+        upcoming.update(dict(counts))
+
     data = []
 
     for artist in search_query:
-        upcoming_shows = Show.query.filter_by(artist_id=artist.id).filter(Show.start_time > current_date).all()
-
         artist_data = {
             "id": artist.id,
             "name": artist.name,
-            "num_upcoming_shows": len(upcoming_shows)
+            "num_upcoming_shows": upcoming[artist.id]
         }
 
         data.append(artist_data)
@@ -328,36 +1197,52 @@ def search_artists():
 def show_artist(artist_id):
     current_date = datetime.now()
 
-    past_shows = Show.query.filter_by(artist_id=artist_id).filter(Show.start_time < current_date).all()
+    artist = Artist.active().filter_by(id=artist_id).first_or_404()
+    page_views.record('artist', artist_id)
+
+    def artist_shows(session):
+        history = show_history('artist_id', artist_id, current_date)
+        past = session.query(history.c.venue_id, history.c.start_time, Venue) \
+            .join(Venue, Venue.id == history.c.venue_id) \
+            .filter(Venue.deleted_at.is_(None)).all()
+        upcoming = session.query(Show).join(Venue) \
+            .filter(Show.artist_id == artist_id, Show.start_time > current_date, Venue.deleted_at.is_(None)) \
+            .options(contains_eager(Show.venue)).all()
+        return past, upcoming
+
+    # An artist plays venues in any region, so their shows are gathered from every shard.
+    per_shard = shards.fan_out(artist_shows)
+    past_shows = sorted(itertools.chain.from_iterable(past for past, _ in per_shard), key=lambda show: show.start_time)
     past_shows_data = []
 
     for past in past_shows:
-        venue_show = Venue.query.get(past.venue_id)
+        venue_show = past.Venue
         past_show_obj = {
-            "venue_id": past.artist_id,
+            "venue_id": past.venue_id,
             "venue_name": venue_show.name,
             "venue_image_link": venue_show.image_link,
+            "venue_version": venue_show.version_id,
             "start_time": past.start_time
         }
 
         past_shows_data.append(past_show_obj)
 
-    upcoming_shows = Show.query.filter_by(artist_id=artist_id).filter(Show.start_time > current_date).all()
+    upcoming_shows = sorted(itertools.chain.from_iterable(upcoming for _, upcoming in per_shard),
+                            key=lambda show: show.start_time)
     upcoming_shows_data = []
 
     for upcoming in upcoming_shows:
-        venue_show = Venue.query.get(upcoming.venue_id)
+        venue_show = upcoming.venue
         upcoming_show_obj = {
-            "venue_id": upcoming.artist_id,
+            "venue_id": upcoming.venue_id,
             "venue_name": venue_show.name,
             "venue_image_link": venue_show.image_link,
+            "venue_version": venue_show.version_id,
             "start_time": upcoming.start_time
         }
 
         upcoming_shows_data.append(upcoming_show_obj)
 
-    artist = Artist.query.get(artist_id)
-
     data = {
         "id": artist.id,
         "name": artist.name,
@@ -370,6 +1255,7 @@ def show_artist(artist_id):
         "seeking_venue": artist.seeking_venue,
         "seeking_description": artist.seeking_description,
         "image_link": artist.image_link,
+        "version": artist.version_id,
         "past_shows": past_shows_data,
         "upcoming_shows": upcoming_shows_data,
         "past_shows_count": len(past_shows_data),
@@ -383,8 +1269,9 @@ def show_artist(artist_id):
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
-    form = ArtistForm()
-    artist = Artist.query.get(artist_id)
+    artist = Artist.active().filter_by(id=artist_id).first_or_404()
+    form = ArtistForm(obj=artist)
+    form.version.data = artist.version_id
 
     return render_template('forms/edit_artist.html', form=form, artist=artist)
 
@@ -392,26 +1279,23 @@ def edit_artist(artist_id):
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
     form = ArtistForm()
-    artist = Artist.query.get(artist_id)
+    artist = Artist.active().filter_by(id=artist_id).first_or_404()
 
     if form.validate():
         try:
-            artist.name = form.name.data
-            artist.city = form.city.data
-            artist.state = form.state.data
-            artist.phone = form.phone.data
-            artist.genres = form.genres.data
-            artist.seeking_venue = form.seeking_venue.data
-            artist.seeking_description = form.seeking_description.data
-            artist.image_link = form.image_link.data
-            artist.website = form.website.data
-            artist.facebook_link = form.facebook_link.data
-
-            db.session.commit()
-        except:
+            conflict = apply_edit(artist, form, ARTIST_EDITABLE_FIELDS)
+        except SQLAlchemyError:
+            app.logger.exception('Could not update artist %s', artist_id)
             db.session.rollback()
-        finally:
-            db.session.close()
+            flash('An error occurred. Artist ' + artist.name + ' could not be updated.')
+            return render_template('forms/edit_artist.html', form=form, artist=artist), 500
+
+        if conflict:
+            form.version.data = artist.version_id
+            flash('Artist ' + artist.name + ' was changed by someone else. Review the differences and submit again.')
+            return render_template('forms/edit_artist.html', form=form, artist=artist, conflict=conflict), 409
+        replicate_artist(artist)
+        thumbnails.submit('artist', artist.id, artist.version_id, artist.image_link)
     else:
         flash('There is a form error')
         return render_template('forms/edit_artist.html', form=form, artist=artist)
@@ -421,8 +1305,9 @@ def edit_artist_submission(artist_id):
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
-    form = VenueForm()
-    venue = Venue.query.get(venue_id)
+    venue = Venue.active(venue_session(venue_id)).filter_by(id=venue_id).first_or_404()
+    form = VenueForm(obj=venue)
+    form.version.data = venue.version_id
 
     return render_template('forms/edit_venue.html', form=form, venue=venue)
 
@@ -430,26 +1315,23 @@ def edit_venue(venue_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
     form = VenueForm()
-    venue = Venue.query.get(venue_id)
+    session = venue_session(venue_id)
+    venue = Venue.active(session).filter_by(id=venue_id).first_or_404()
 
     if form.validate():
         try:
-            venue.name = form.name.data
-            venue.city = form.city.data
-            venue.state = form.state.data
-            venue.phone = form.phone.data
-            venue.genres = form.genres.data
-            venue.seeking_talent = form.seeking_talent.data
-            venue.seeking_description = form.seeking_description.data
-            venue.image_link = form.image_link.data
-            venue.website = form.website.data
-            venue.facebook_link = form.facebook_link.data
-
-            db.session.commit()
-        except:
-            db.session.rollback()
-        finally:
-            db.session.close()
+            conflict = apply_edit(venue, form, VENUE_EDITABLE_FIELDS, session)
+        except SQLAlchemyError:
+            app.logger.exception('Could not update venue %s', venue_id)
+            rollback(session)
+            flash('An error occurred. Venue ' + venue.name + ' could not be updated.')
+            return render_template('forms/edit_venue.html', form=form, venue=venue), 500
+
+        if conflict:
+            form.version.data = venue.version_id
+            flash('Venue ' + venue.name + ' was changed by someone else. Review the differences and submit again.')
+            return render_template('forms/edit_venue.html', form=form, venue=venue, conflict=conflict), 409
+        thumbnails.submit('venue', venue.id, venue.version_id, venue.image_link)
     else:
         flash('There is a form error')
         return render_template('forms/edit_venue.html', form=form, venue=venue)
@@ -457,6 +1339,28 @@ def edit_venue_submission(venue_id):
     return redirect(url_for('show_venue', venue_id=venue_id))
 
 
+@app.route('/artists/<int:artist_id>', methods=['DELETE'])
+def delete_artist(artist_id):
+    artist = Artist.active().filter_by(id=artist_id).first_or_404()
+    artist_name = artist.name
+
+    try:
+        artist.soft_delete()
+        record_change(artist, 'delete')
+        db.session.commit()
+        replicate_artist(artist)
+        entities_changed()
+        flash('Artist ' + artist_name + ' was successfully deleted!')
+    except SQLAlchemyError:
+        app.logger.exception('Could not delete artist %s', artist_id)
+        flash('An error occurred. Artist ' + artist_name + ' could not be deleted.')
+        db.session.rollback()
+    finally:
+        db.session.close()
+
+    return redirect(url_for('index'))
+
+
 #  Create Artist
 #  ----------------------------------------------------------------
 
@@ -484,7 +1388,11 @@ def create_artist_submission():
                                 facebook_link=form.facebook_link.data
                                 )
             db.session.add(new_artist)
+            record_change(new_artist, 'create')
             db.session.commit()
+            replicate_artist(new_artist)
+            entities_changed()
+            thumbnails.submit('artist', new_artist.id, new_artist.version_id, new_artist.image_link)
             flash('Artist ' + request.form['name'] + ' was successfully listed!')
         except:
             flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.')
@@ -501,26 +1409,97 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
+def show_listing(session):
+    return session.query(Show.venue_id, Venue.name.label('venue_name'),
+                         Show.artist_id, Artist.name.label('artist_name'),
+                         Artist.image_link, Artist.version_id, Show.start_time) \
+        .join(Venue, Show.venue_id == Venue.id) \
+        .join(Artist, Show.artist_id == Artist.id) \
+        .filter(Venue.deleted_at.is_(None), Artist.deleted_at.is_(None)) \
+        .order_by(Show.start_time)
+
+
 @app.route('/shows')
 def shows():
-    all_shows = Show.query.all()
-    data = []
+    rows, stale = stale_fallback('shows', listing_rows(show_listing, key=lambda row: row.start_time))
+
+    data = ({
+        "venue_id": show.venue_id,
+        "venue_name": show.venue_name,
+        "artist_id": show.artist_id,
+        "artist_name": show.artist_name,
+        "artist_image_link": show.image_link,
+        "artist_version": show.version_id,
+        "start_time": str(show.start_time)
+    } for show in rows)
+
+    return render_listing('pages/shows.html', shows=data, stale=stale)
+
+
+ENTITY_MODELS = {'artist': Artist, 'venue': Venue}
 
-    for show in all_shows:
-        artist = Artist.query.get(show.artist_id)
-        venue = Venue.query.get(show.venue_id)
-
-        data_obj = {
-            "venue_id": show.venue_id,
-            "venue_name": venue.name,
-            "artist_id": show.artist_id,
-            "artist_name": artist.name,
-            "artist_image_link": artist.image_link,
-            "start_time": str(show.start_time)
-        }
-        data.append(data_obj)
 
-    return render_template('pages/shows.html', shows=data)
+def find_entity(model, entity_id):
+    session = None
+    if model is Venue and shards.enabled:
+        shard = venue_shard(entity_id)
+        if shard is None:
+            return None
+        session = shards.session(shard)
+    return model.active(session).filter_by(id=entity_id).first()
+
+
+def entity_exists(kind, entity_id):
+    return find_entity(ENTITY_MODELS[kind], entity_id) is not None
+
+
+def lookup_page(model, search, page):
+    size = app.config['LOOKUP_PAGE_SIZE']
+
+    def names(session, offset, limit):
+        query = model.active(session).with_entities(model.id, model.name)
+        if search:
+            query = query.filter(model.name.ilike('%{}%'.format(search)))
+        return query.order_by(model.name, model.id).offset(offset).limit(limit).all()
+
+    if model is Venue and shards.enabled:
+        # Every shard may hold part of the page, so each returns everything up to its end.
+        per_shard = shards.fan_out(lambda session: names(session, 0, page * size + 1))
+        rows = list(itertools.islice(heapq.merge(*per_shard, key=lambda row: (row.name or '', row.id)),
+                                     (page - 1) * size, page * size + 1))
+    else:
+        rows = names(None, (page - 1) * size, size + 1)
+
+    return {
+        "results": [{"id": row.id, "name": row.name} for row in rows[:size]],
+        "page": page,
+        "has_more": len(rows) > size,
+    }
+
+
+cached_lookup_page = ttl_cache(app.config['LOOKUP_CACHE_SECONDS'])(lookup_page)
+
+
+def entities_changed():
+    cached_lookup_page.invalidate()
+
+
+@app.route('/api/lookup/<kind>')
+def lookup(kind):
+    """Paginated id/name options for the artist and venue selects of the show form."""
+    if kind not in ENTITY_MODELS:
+        abort(404)
+    search = request.args.get('q', '').strip()
+    page = min(max(request.args.get('page', 1, type=int), 1), app.config['LOOKUP_MAX_PAGE'])
+    if not search and page <= app.config['LOOKUP_CACHED_PAGES']:
+        return jsonify(cached_lookup_page(ENTITY_MODELS[kind], search, page))
+    return jsonify(lookup_page(ENTITY_MODELS[kind], search, page))
+
+
+def keep_selection(field, kind):
+    """Give a select whose options are loaded by the page the submitted option, for re-rendering."""
+    entity = find_entity(ENTITY_MODELS[kind], field.data) if field.data else None
+    field.choices = [(entity.id, entity.name)] if entity else []
 
 
 @app.route('/shows/create')
@@ -532,28 +1511,298 @@ def create_shows():
 
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
-    form = ShowForm()
+    form = ShowForm(exists=entity_exists)
 
     if form.validate():
+        # Shows live on the shard of the venue they are held at.
+        session = venue_session(form.venue_id.data)
         try:
-            new_show = Show(artist_id=request.form['artist_id'],
-                            venue_id=request.form['venue_id'],
-                            start_time=request.form['start_time']
+            new_show = Show(artist_id=form.artist_id.data,
+                            venue_id=form.venue_id.data,
+                            start_time=form.start_time.data
                             )
-            db.session.add(new_show)
-            db.session.commit()
+            if shards.enabled:
+                new_show.id = allocate_show_id()
+            session.add(new_show)
+            record_change(new_show, 'create', session)
+            commit(session)
             flash('Show was successfully listed!')
         except:
             flash('An error occurred. Show could not be listed.')
-            db.session.rollback()
+            rollback(session)
         finally:
+            session.close()
             db.session.close()
     else:
         flash('There is a form error')
-        render_template('forms/new_show.html', form=form)
+        keep_selection(form.artist_id, 'artist')
+        keep_selection(form.venue_id, 'venue')
+        return render_template('forms/new_show.html', form=form)
     return render_template('pages/home.html')
 
 
+#  Changes
+#  ----------------------------------------------------------------
+
+@app.route('/api/changes')
+def changes():
+    since = request.args.get('since', 0, type=int)
+    limit = min(request.args.get('limit', 100, type=int), app.config['CHANGE_FEED_MAX_LIMIT'])
+    rows = changes_since(since, limit)
+
+    return jsonify({
+        "changes": [change.to_dict() for change in rows],
+        "next": rows[-1].position if rows else since,
+    })
+
+
+@app.route('/api/changes/stream')
+def change_stream():
+    since = request.headers.get('Last-Event-ID', type=int) or request.args.get('since', 0, type=int)
+    poll_interval = app.config['CHANGE_STREAM_POLL_INTERVAL']
+    deadline = time.monotonic() + app.config['CHANGE_STREAM_MAX_SECONDS']
+
+    def events(cursor):
+        # Clients reconnect with Last-Event-ID once the stream ends at the deadline.
+        while time.monotonic() < deadline:
+            rows = changes_since(cursor, app.config['CHANGE_FEED_MAX_LIMIT'])
+            # Don't sit idle in a transaction between polls.
+            db.session.rollback()
+            for change in rows:
+                yield 'id: {}\nevent: change\ndata: {}\n\n'.format(change.position, json.dumps(change.to_dict()))
+                cursor = change.position
+            if not rows:
+                yield ': keepalive\n\n'
+                time.sleep(poll_interval)
+
+    return Response(stream_with_context(events(since)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+#  Maintenance
+#  ----------------------------------------------------------------
+
+def maintenance_sessions():
+    """Each shard's session followed by the primary's, for commands that sweep every database."""
+    return [shards.session(name) for name in sorted(shards.sessions)] + [db.session]
+
+
+def purge_shows(session, key, entity_id, batch_size):
+    # Small batches committed one at a time keep row locks on `shows` short.
+    for model in (Show, ArchivedShow):
+        column = getattr(model, key)
+        while True:
+            batch = [show_id for (show_id,) in
+                     session.query(model.id).filter(column == entity_id).limit(batch_size)]
+            if not batch:
+                break
+            session.query(model).filter(model.id.in_(batch)).delete(synchronize_session=False)
+            session.commit()
+
+
+@app.cli.command('purge-deleted')
+@click.option('--batch-size', default=None, type=int, help='Shows removed per transaction.')
+def purge_deleted(batch_size):
+    """Hard-delete soft-deleted venues and artists past the grace period."""
+    batch_size = batch_size or app.config['PURGE_BATCH_SIZE']
+    cutoff = datetime.now() - app.config['PURGE_GRACE_PERIOD']
+    sessions = maintenance_sessions()
+
+    # A venue and its shows live on one shard; its directory entry goes once they are gone.
+    purged = 0
+    for session in sessions:
+        expired = [venue_id for (venue_id,) in session.query(Venue.id).filter(Venue.deleted_at < cutoff)]
+        for venue_id in expired:
+            purge_shows(session, 'venue_id', venue_id, batch_size)
+            session.query(Venue).filter_by(id=venue_id).delete()
+            session.commit()
+            VenueShard.query.filter_by(venue_id=venue_id).delete()
+            db.session.commit()
+        purged += len(expired)
+    click.echo('Purged {} venues'.format(purged))
+
+    # An artist's shows can be on any shard, and every shard holds a copy of the artist.
+    expired = [artist_id for (artist_id,) in db.session.query(Artist.id).filter(Artist.deleted_at < cutoff)]
+    for artist_id in expired:
+        for session in sessions:
+            purge_shows(session, 'artist_id', artist_id, batch_size)
+            session.query(Artist).filter_by(id=artist_id).delete()
+            session.commit()
+    click.echo('Purged {} artists'.format(len(expired)))
+
+
+@app.cli.command('rollup-page-views')
+def rollup_page_views():
+    """Roll hourly page views up into daily rows and drop hourly rows past retention."""
+    page_views.flush()
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    retention_start = today - app.config['PAGE_VIEW_HOURLY_RETENTION']
+
+    day = retention_start
+    while day < today:
+        next_day = day + timedelta(days=1)
+        totals = db.session.query(PageViewCount.entity_type, PageViewCount.entity_id,
+                                  func.sum(PageViewCount.views)) \
+            .filter(PageViewCount.granularity == 'hour',
+                    PageViewCount.bucket_start >= day,
+                    PageViewCount.bucket_start < next_day) \
+            .group_by(PageViewCount.entity_type, PageViewCount.entity_id).all()
+        if totals:
+            PageViewCount.query.filter_by(granularity='day', bucket_start=day).delete()
+            db.session.add_all([PageViewCount(entity_type=entity_type, entity_id=entity_id,
+                                              granularity='day', bucket_start=day, views=views)
+                                for entity_type, entity_id, views in totals])
+            db.session.commit()
+        day = next_day
+
+    expired = PageViewCount.query.filter(PageViewCount.granularity == 'hour',
+                                         PageViewCount.bucket_start < retention_start).delete()
+    db.session.commit()
+    click.echo('Dropped {} expired hourly rows'.format(expired))
+
+
+shows_cli = AppGroup('shows', help='Show history maintenance.')
+app.cli.add_command(shows_cli)
+
+
+def add_months(moment, months):
+    month = moment.month - 1 + months
+    return moment.replace(year=moment.year + month // 12, month=month % 12 + 1, day=1,
+                          hour=0, minute=0, second=0, microsecond=0)
+
+
+def partition_name(month):
+    return 'shows_p{:%Y_%m}'.format(month)
+
+
+def require_postgresql():
+    if db.engine.dialect.name != 'postgresql':
+        raise click.ClickException('`shows` is only partitioned on PostgreSQL; use `flask shows archive`.')
+
+
+@shows_cli.command('partitions')
+@click.option('--months-ahead', default=3, help='Monthly partitions to create past the current month.')
+def create_show_partitions(months_ahead):
+    """Create the upcoming monthly partitions of `shows` (PostgreSQL)."""
+    require_postgresql()
+    this_month = add_months(datetime.now(), 0)
+    for offset in range(months_ahead + 1):
+        start = add_months(this_month, offset)
+        name = partition_name(start)
+        if db.session.execute(text('SELECT to_regclass(:name)'), {'name': name}).scalar():
+            continue
+        # Shows already booked for this month sit in shows_default, and PostgreSQL refuses to add a
+        # partition that would claim rows of the default one. Detach it, add the partition, move the
+        # month's rows over and attach it again, all in one transaction.
+        params = {'start': start, 'end': add_months(start, 1)}
+        db.session.execute(text('ALTER TABLE shows DETACH PARTITION shows_default'))
+        db.session.execute(text('CREATE TABLE {} PARTITION OF shows FOR VALUES FROM (:start) TO (:end)'
+                                .format(name)), params)
+        moved = db.session.execute(text(
+            'WITH moved AS (DELETE FROM shows_default WHERE start_time >= :start AND start_time < :end '
+            'RETURNING id, venue_id, artist_id, start_time) '
+            'INSERT INTO shows (id, venue_id, artist_id, start_time) SELECT * FROM moved'), params).rowcount
+        db.session.execute(text('ALTER TABLE shows ATTACH PARTITION shows_default DEFAULT'))
+        db.session.commit()
+        click.echo('Partition {} ready, {} shows moved from shows_default'.format(name, moved))
+
+
+@shows_cli.command('detach')
+@click.option('--before', required=True, type=click.DateTime(formats=['%Y-%m']),
+              help='Detach monthly partitions that end on or before this month.')
+def detach_show_partitions(before):
+    """Detach old monthly partitions of `shows` so they can be compressed, dumped or dropped (PostgreSQL)."""
+    require_postgresql()
+    partitions = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'shows'::regclass AND c.relname LIKE 'shows\\_p%' ORDER BY c.relname")).fetchall()
+    for (name,) in partitions:
+        month = datetime.strptime(name, 'shows_p%Y_%m')
+        if add_months(month, 1) <= before:
+            db.session.execute(text('ALTER TABLE shows DETACH PARTITION {}'.format(name)))
+            db.session.commit()
+            click.echo('Detached {}'.format(name))
+
+
+@shows_cli.command('archive')
+@click.option('--before', required=True, type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Move shows that started before this date.')
+@click.option('--batch-size', default=None, type=int, help='Shows moved per transaction.')
+def archive_shows(before, batch_size):
+    """Move past shows from `shows` into `shows_archive` in batches."""
+    batch_size = batch_size or app.config['PURGE_BATCH_SIZE']
+    columns = ('id', 'venue_id', 'artist_id', 'start_time')
+    moved = 0
+    for session in maintenance_sessions():
+        while True:
+            batch = [show_id for (show_id,) in
+                     session.query(Show.id).filter(Show.start_time < before).order_by(Show.id).limit(batch_size)]
+            if not batch:
+                break
+            session.execute(ArchivedShow.__table__.insert().from_select(
+                columns, db.select([getattr(Show, column) for column in columns]).where(Show.id.in_(batch))))
+            session.query(Show).filter(Show.id.in_(batch)).delete(synchronize_session=False)
+            session.commit()
+            moved += len(batch)
+    click.echo('Archived {} shows'.format(moved))
+
+
+snapshot_cli = AppGroup('snapshot', help='Synthetic datasets for local development and benchmarks.')
+app.cli.add_command(snapshot_cli)
+
+SNAPSHOT_MODELS = {'venues': Venue, 'artists': Artist, 'shows': Show}
+SNAPSHOT_INSERT_BATCH = 5000
+
+
+@snapshot_cli.command('generate')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--venues', default=2000, help='Number of venues.')
+@click.option('--artists', default=10000, help='Number of artists.')
+@click.option('--shows', default=200000, help='Number of shows.')
+@click.option('--seed', default=0, help='Random seed; the same seed and sizes give an identical file.')
+def generate_snapshot(path, venues, artists, shows, seed):
+    """Write a deterministic synthetic dataset to PATH."""
+    snapshot.write(path, snapshot.generate(seed, venues, artists, shows), seed=seed)
+    click.echo('Wrote {} venues, {} artists and {} shows to {}'.format(venues, artists, shows, path))
+
+
+@snapshot_cli.command('load')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--replace', is_flag=True, help='Delete existing venues, artists and shows first.')
+def load_snapshot(path, replace):
+    """Load a snapshot written by `flask snapshot generate` into the primary database."""
+    started = time.monotonic()
+    header, rows = snapshot.read(path)
+    tables = snapshot.prepare(header, rows, datetime.now())
+
+    if replace:
+        for model in (ArchivedShow, Show, Venue, Artist):
+            model.query.delete()
+    elif any(model.query.first() for model in SNAPSHOT_MODELS.values()):
+        raise click.ClickException('The database already has data; pass --replace to overwrite it.')
+
+    if db.engine.dialect.name == 'postgresql':
+        cursor = db.session.connection().connection.cursor()
+        for name, (columns, table_rows) in tables.items():
+            snapshot.copy_rows(cursor, name, columns, table_rows)
+        # COPY bypasses the id sequences, so move them past the loaded ids.
+        for name in tables:
+            db.session.execute(text("SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                                    "coalesce(max(id), 0) + 1, false) FROM {0}".format(name)))
+    else:
+        for name, (columns, table_rows) in tables.items():
+            table = SNAPSHOT_MODELS[name].__table__
+            for start in range(0, len(table_rows), SNAPSHOT_INSERT_BATCH):
+                db.session.execute(table.insert(), [dict(zip(columns, row))
+                                                    for row in table_rows[start:start + SNAPSHOT_INSERT_BATCH]])
+    db.session.commit()
+    trending.invalidate()
+
+    click.echo('Loaded {} in {:.1f}s'.format(
+        ', '.join('{} {}'.format(len(table_rows), name) for name, (_, table_rows) in tables.items()),
+        time.monotonic() - started))
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -572,7 +1821,6 @@ if not app.debug:
     app.logger.setLevel(logging.INFO)
     file_handler.setLevel(logging.INFO)
     app.logger.addHandler(file_handler)
-    app.logger.info('errors')
 
 # ----------------------------------------------------------------------------#
 # Launch.
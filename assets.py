@@ -0,0 +1,137 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+
+try:
+    import brotli
+except ImportError:  # .br variants are only written when the brotli package is installed
+    brotli = None
+
+# Bundles served by layouts/main.html, as paths relative to the static folder.
+BUNDLES = {
+    'app.css': [
+        'css/bootstrap.min.css',
+        'css/layout.main.css',
+        'css/main.css',
+        'css/main.responsive.css',
+        'css/main.quickfix.css',
+    ],
+    'head.js': [
+        'js/libs/modernizr-2.8.2.min.js',
+        'js/libs/moment.min.js',
+    ],
+    'body.js': [
+        'js/script.js',
+        'js/libs/bootstrap-3.1.1.min.js',
+        'js/plugins.js',
+    ],
+}
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+# Files in static/fonts are copied to dist/fonts under content-hashed names, and the CSS
+# bundles' url(../fonts/...) references are pointed at those copies.
+FONTS_DIR = 'fonts'
+FONT_URL = re.compile(r'url\(([\'"]?)\.\./fonts/([^\'")?#]+)')
+
+
+def _minify_css_rules(source):
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    return source.replace(';}', '}').strip()
+
+
+def minify_css(source):
+    # /*! ... */ comments carry license headers and are kept verbatim.
+    parts = re.split(r'(/\*!.*?\*/)', source, flags=re.S)
+    return ''.join(part if part.startswith('/*!') else _minify_css_rules(part) for part in parts).strip()
+
+
+def minify_js(source):
+    # Regex-minifying JavaScript is unsafe (strings, regex literals, ASI), so sources are only
+    # concatenated; the vendored libraries are already minified.
+    return source.strip()
+
+
+def fingerprint(content, name):
+    stem, ext = os.path.splitext(name)
+    return '{}.{}{}'.format(stem, hashlib.sha256(content).hexdigest()[:12], ext)
+
+
+def build_fonts(static_folder, dist):
+    """Copy static/fonts into dist/fonts under fingerprinted names; returns {name: fingerprinted name}."""
+    source_dir = os.path.join(static_folder, FONTS_DIR)
+    if not os.path.isdir(source_dir):
+        return {}
+    os.makedirs(os.path.join(dist, FONTS_DIR), exist_ok=True)
+
+    fonts = {}
+    for name in sorted(os.listdir(source_dir)):
+        with open(os.path.join(source_dir, name), 'rb') as f:
+            content = f.read()
+        fonts[name] = fingerprint(content, name)
+        with open(os.path.join(dist, FONTS_DIR, fonts[name]), 'wb') as f:
+            f.write(content)
+    return fonts
+
+
+def rewrite_font_urls(source, fonts):
+    # Bundles live in dist/, so the copies are at fonts/<name> relative to them. Fonts that are
+    # not on disk keep their original reference.
+    def replace(match):
+        quote, name = match.groups()
+        if name not in fonts:
+            return match.group(0)
+        return 'url({}{}/{}'.format(quote, FONTS_DIR, fonts[name])
+
+    return FONT_URL.sub(replace, source)
+
+
+def bundle(static_folder, name, fonts=None):
+    is_css = name.endswith('.css')
+    minify = minify_css if is_css else minify_js
+    separator = '\n' if is_css else ';\n'
+    parts = []
+    for source in BUNDLES[name]:
+        with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+            content = minify(f.read())
+        parts.append(rewrite_font_urls(content, fonts or {}) if is_css else content)
+    return separator.join(parts).encode('utf-8')
+
+
+def build(static_folder):
+    """Write minified, content-hashed bundles plus .gz/.br variants and fingerprinted fonts; return the manifest."""
+    dist = os.path.join(static_folder, DIST_DIR)
+    os.makedirs(dist, exist_ok=True)
+
+    fonts = build_fonts(static_folder, dist)
+    manifest = {}
+    for name in BUNDLES:
+        content = bundle(static_folder, name, fonts)
+        filename = fingerprint(content, name)
+
+        path = os.path.join(dist, filename)
+        with open(path, 'wb') as f:
+            f.write(content)
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(content, quality=11))
+
+        manifest[name] = filename
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
@@ -0,0 +1,48 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+
+def ttl_cache(seconds, maxsize=None, cache_none=True):
+    """Memoize a function's result per argument tuple for ``seconds``.
+
+    With ``maxsize`` the least recently used entries are evicted beyond that many; with
+    ``cache_none=False`` a ``None`` result is not cached, so lookups of ids that do not exist
+    yet neither stick nor fill the cache.
+
+    The wrapped function gains ``invalidate()`` to drop every cached entry, e.g. after a write.
+    """
+    def decorator(func):
+        entries = OrderedDict()
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(*args):
+            now = time.monotonic()
+            entry = entries.get(args)
+            if entry is not None and entry[0] > now:
+                if maxsize is not None:
+                    with lock:
+                        if args in entries:
+                            entries.move_to_end(args)
+                return entry[1]
+            value = func(*args)
+            if value is None and not cache_none:
+                return value
+            with lock:
+                entries[args] = (now + seconds, value)
+                entries.move_to_end(args)
+                if maxsize is not None:
+                    while len(entries) > maxsize:
+                        entries.popitem(last=False)
+            return value
+
+        def invalidate():
+            with lock:
+                entries.clear()
+
+        wrapper.invalidate = invalidate
+        return wrapper
+
+    return decorator
@@ -1,26 +1,11 @@
 from datetime import datetime
 from flask_wtf import FlaskForm
 from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, TextAreaField, \
-    SubmitField
-from wtforms.validators import DataRequired, AnyOf, ValidationError
+    SubmitField, HiddenField
+from wtforms.validators import DataRequired, ValidationError
 from enum import Enum
 
 
-class ShowForm(FlaskForm):
-    artist_id = StringField(
-        'artist_id', validators=[DataRequired()]
-    )
-    venue_id = StringField(
-        'venue_id', validators=[DataRequired()]
-    )
-    start_time = DateTimeField(
-        'start_time',
-        validators=[DataRequired()],
-        default=datetime.today()
-    )
-    submit = SubmitField('Add Show')
-
-
 class UnitedState(Enum):
     AL = 'Alabama'
     AK = 'Alaska'
@@ -103,6 +88,68 @@ class Genre(Enum):
         return [(choice.value, choice.value) for choice in cls]
 
 
+# Built once at import; forms are instantiated on every request.
+STATE_CHOICES = UnitedState.choices()
+STATE_CODES = frozenset(code for code, _ in STATE_CHOICES)
+GENRE_CHOICES = Genre.choices()
+GENRE_VALUES = frozenset(value for value, _ in GENRE_CHOICES)
+
+
+class SetSelectField(SelectField):
+    """SelectField checked by membership in the frozenset ``values`` instead of a scan of its choices."""
+
+    def __init__(self, label=None, validators=None, values=frozenset(), **kwargs):
+        super(SetSelectField, self).__init__(label, validators, **kwargs)
+        self.values = values
+
+    def pre_validate(self, form):
+        if self.data not in self.values:
+            raise ValueError(self.gettext('Not a valid choice'))
+
+
+class SetSelectMultipleField(SelectMultipleField):
+    """SelectMultipleField checked by membership in the frozenset ``values``."""
+
+    def __init__(self, label=None, validators=None, values=frozenset(), **kwargs):
+        super(SetSelectMultipleField, self).__init__(label, validators, **kwargs)
+        self.values = values
+
+    def pre_validate(self, form):
+        for value in self.data or ():
+            if value not in self.values:
+                raise ValueError(self.gettext("'%(value)s' is not a valid choice for this field") % dict(value=value))
+
+
+class ShowForm(FlaskForm):
+    # Options are fetched page by page from /api/lookup/<kind> by the form page, so the
+    # submitted ids are checked with ``exists`` rather than against a list of choices.
+    artist_id = SelectField(
+        'artist_id', validators=[DataRequired()], coerce=int, choices=[], validate_choice=False
+    )
+    venue_id = SelectField(
+        'venue_id', validators=[DataRequired()], coerce=int, choices=[], validate_choice=False
+    )
+    start_time = DateTimeField(
+        'start_time',
+        validators=[DataRequired()],
+        default=datetime.today
+    )
+    submit = SubmitField('Add Show')
+
+    def __init__(self, *args, exists=None, **kwargs):
+        """``exists(kind, entity_id)`` tells whether an active 'artist' or 'venue' has that id."""
+        super(ShowForm, self).__init__(*args, **kwargs)
+        self.exists = exists
+
+    def validate_artist_id(form, field):
+        if form.exists is not None and not form.exists('artist', field.data):
+            raise ValidationError('Unknown artist')
+
+    def validate_venue_id(form, field):
+        if form.exists is not None and not form.exists('venue', field.data):
+            raise ValidationError('Unknown venue')
+
+
 class VenueForm(FlaskForm):
     name = StringField(
         'name', validators=[DataRequired()]
@@ -110,9 +157,9 @@ class VenueForm(FlaskForm):
     city = StringField(
         'city', validators=[DataRequired()]
     )
-    state = SelectField(
-        'state', validators=[DataRequired(), AnyOf([(choice.name) for choice in UnitedState])],
-        choices=UnitedState.choices()
+    state = SetSelectField(
+        'state', validators=[DataRequired()],
+        choices=STATE_CHOICES, values=STATE_CODES
     )
     address = StringField(
         'address', validators=[DataRequired()]
@@ -125,9 +172,9 @@ class VenueForm(FlaskForm):
     )
     seeking_talent = BooleanField()
     seeking_description = TextAreaField('seeking_description', render_kw={"rows": 5, "cols": 54.5})
-    genres = SelectMultipleField(
+    genres = SetSelectMultipleField(
         'genres', validators=[DataRequired()],
-        choices=Genre.choices()
+        choices=GENRE_CHOICES, values=GENRE_VALUES
     )
     website = StringField(
         'website',
@@ -136,6 +183,8 @@ class VenueForm(FlaskForm):
         'facebook_link',
     )
     submit = SubmitField('Add Venue')
+    # Row version the edit form was rendered with, see apply_edit in app.py.
+    version = HiddenField('version')
 
     def validate_phone(form, field):
         if len(field.data) > 10 or len(field.data) < 10:
@@ -149,8 +198,8 @@ class ArtistForm(FlaskForm):
     city = StringField(
         'city', validators=[DataRequired()]
     )
-    state = SelectField(
-        'state', validators=[DataRequired(), AnyOf([(choice.name) for choice in UnitedState])], choices=UnitedState.choices()
+    state = SetSelectField(
+        'state', validators=[DataRequired()], choices=STATE_CHOICES, values=STATE_CODES
     )
     phone = StringField(
         'phone', validators=[DataRequired()]
@@ -158,9 +207,9 @@ class ArtistForm(FlaskForm):
     image_link = StringField(
         'image_link',
     )
-    genres = SelectMultipleField(
+    genres = SetSelectMultipleField(
         'genres', validators=[DataRequired()],
-        choices=Genre.choices()
+        choices=GENRE_CHOICES, values=GENRE_VALUES
     )
     seeking_venue = BooleanField()
     seeking_description = TextAreaField('seeking_description', render_kw={"rows": 5, "cols": 54.5})
@@ -171,6 +220,8 @@ class ArtistForm(FlaskForm):
         'website',
     )
     submit = SubmitField('Add Artist')
+    # Row version the edit form was rendered with, see apply_edit in app.py.
+    version = HiddenField('version')
 
     def validate_phone(form, field):
         if len(field.data) > 10 or len(field.data) < 10:
@@ -0,0 +1,188 @@
+import http.client
+import io
+import ipaddress
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from urllib.request import HTTPHandler, HTTPRedirectHandler, HTTPSHandler, ProxyHandler, Request, build_opener
+
+try:
+    from PIL import Image
+except ImportError:  # without Pillow no thumbnails are generated and callers fall back to the source URL
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+
+class ImageError(Exception):
+    pass
+
+
+def check_address(address):
+    """Refuse loopback, private, link-local and other non-public addresses (e.g. cloud metadata)."""
+    ip = ipaddress.ip_address(address.split('%')[0])
+    if getattr(ip, 'ipv4_mapped', None):
+        ip = ip.ipv4_mapped
+    if not ip.is_global or ip.is_multicast:
+        raise ImageError('refusing to fetch from non-public address {}'.format(ip))
+
+
+def create_public_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """socket.create_connection that checks every address the host resolves to, then connects to
+    the checked address itself so a second DNS answer cannot swap in an internal one."""
+    host, port = address
+    addresses = [info[4][0] for info in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)]
+    for resolved in addresses:
+        check_address(resolved)
+    return socket.create_connection((addresses[0], port), timeout, source_address)
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super(PublicHTTPConnection, self).__init__(*args, **kwargs)
+        self._create_connection = create_public_connection
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super(PublicHTTPSConnection, self).__init__(*args, **kwargs)
+        self._create_connection = create_public_connection
+
+
+class PublicHTTPHandler(HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+class RedirectHandler(HTTPRedirectHandler):
+    # Every hop connects through the handlers above, so redirects get the same address check.
+    max_redirections = 3
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if urlparse(newurl).scheme not in ('http', 'https'):
+            raise ImageError('unsupported redirect to ' + newurl)
+        return super(RedirectHandler, self).redirect_request(req, fp, code, msg, headers, newurl)
+
+
+# No ProxyHandler from the environment: a proxy would make the connection checks meaningless.
+opener = build_opener(ProxyHandler({}), PublicHTTPHandler, PublicHTTPSHandler, RedirectHandler)
+
+
+class ThumbnailCache(object):
+    """Resized copies of remote venue/artist images, kept on local disk under an LRU size cap.
+
+    Files are keyed by (kind, entity id, row version, size, format), so an edited ``image_link``
+    simply produces new keys and the stale files age out through eviction.
+    """
+
+    def __init__(self, directory, sizes, max_bytes, fetch_timeout=10, max_source_bytes=10 * 1024 * 1024):
+        self.directory = directory
+        self.sizes = sizes
+        self.max_bytes = max_bytes
+        self.fetch_timeout = fetch_timeout
+        self.max_source_bytes = max_source_bytes
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        self._pending = set()
+        self._failed = set()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def path(self, kind, entity_id, version, size, fmt):
+        return os.path.join(self.directory, '{}-{}-{}-{}.{}'.format(kind, entity_id, version, size, fmt))
+
+    def get(self, kind, entity_id, version, size, fmt):
+        path = self.path(kind, entity_id, version, size, fmt)
+        try:
+            # Eviction goes by mtime, so a hit marks the file as recently used.
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def failed(self, kind, entity_id, version):
+        return (kind, entity_id, version) in self._failed
+
+    def submit(self, kind, entity_id, version, url):
+        """Generate every size for this image in the background; duplicate requests are ignored."""
+        key = (kind, entity_id, version)
+        if not self.enabled or not url:
+            return
+        if all(os.path.exists(self.path(*key, size=size, fmt=fmt)) for size in self.sizes for fmt in FORMATS):
+            return
+        with self._lock:
+            if key in self._pending or key in self._failed:
+                return
+            self._pending.add(key)
+        self._executor.submit(self._ingest, key, url)
+
+    def _ingest(self, key, url):
+        try:
+            image = self._open(self._fetch(url))
+            for size, dimensions in self.sizes.items():
+                thumbnail = image.copy()
+                thumbnail.thumbnail(dimensions)
+                for fmt, pil_format in FORMATS.items():
+                    path = self.path(*key, size=size, fmt=fmt)
+                    thumbnail.save(path + '.tmp', pil_format, quality=82)
+                    os.replace(path + '.tmp', path)
+            self._evict()
+        except (ImageError, OSError, ValueError, http.client.HTTPException) as e:
+            logger.warning('Could not generate thumbnails for %s from %s: %s', key, url, e)
+            with self._lock:
+                if len(self._failed) > 10000:
+                    self._failed.clear()
+                self._failed.add(key)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _fetch(self, url):
+        if urlparse(url).scheme not in ('http', 'https'):
+            raise ImageError('unsupported URL scheme')
+        request = Request(url, headers={'User-Agent': 'Fyyur thumbnailer'})
+        with opener.open(request, timeout=self.fetch_timeout) as response:
+            if not response.headers.get_content_type().startswith('image/'):
+                raise ImageError('not an image: ' + response.headers.get_content_type())
+            data = response.read(self.max_source_bytes + 1)
+        if len(data) > self.max_source_bytes:
+            raise ImageError('image larger than {} bytes'.format(self.max_source_bytes))
+        return data
+
+    def _open(self, data):
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except (Image.DecompressionBombError, SyntaxError, ValueError) as e:
+            raise ImageError(str(e))
+        return image.convert('RGB')
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
@@ -0,0 +1,26 @@
+import threading
+
+
+class ConcurrencyLimiter(object):
+    """Admits at most ``limit`` requests at once; callers shed the rest instead of queueing them."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        return {"limit": self.limit, "in_flight": self.in_flight, "shed": self.shed}
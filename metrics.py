@@ -0,0 +1,109 @@
+import threading
+import time
+
+# Log-linear buckets in the style of HdrHistogram: values below 2 * SUB_BUCKETS microseconds get a
+# bucket each, above that every power of two is split into SUB_BUCKETS linear steps, so any value
+# is reported within 1/SUB_BUCKETS (about 3%) of what was recorded.
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# Latencies are clamped to 2**32 microseconds (71 minutes).
+MAX_VALUE = (1 << 32) - 1
+
+
+def bucket_index(value):
+    shift = max(0, value.bit_length() - SUB_BUCKET_BITS - 1)
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_value(index):
+    """Highest value that falls into bucket ``index``."""
+    shift = max(0, (index >> SUB_BUCKET_BITS) - 1)
+    return ((index - shift * SUB_BUCKETS + 1) << shift) - 1
+
+
+BUCKETS = bucket_index(MAX_VALUE) + 1
+
+
+class LatencyHistogram(object):
+    """Fixed-size histogram of microsecond latencies; recording is a single list increment."""
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.total = 0
+        self.max = 0
+
+    def record(self, microseconds):
+        value = min(max(int(microseconds), 0), MAX_VALUE)
+        self.counts[bucket_index(value)] += 1
+        self.total += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentiles(self, *quantiles):
+        """Values at each quantile (0-1], in microseconds; None for an empty histogram."""
+        if not self.total:
+            return [None] * len(quantiles)
+        targets = sorted((max(1, int(round(q * self.total))), i) for i, q in enumerate(quantiles))
+        results = [None] * len(quantiles)
+        seen = 0
+        position = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            while position < len(targets) and seen >= targets[position][0]:
+                results[targets[position][1]] = min(bucket_value(index), self.max)
+                position += 1
+            if position == len(targets):
+                break
+        return results
+
+
+class RollingLatency(object):
+    """Per-route latency histograms over the last ``window`` seconds.
+
+    The window is split into ``slots`` histograms; the oldest is dropped as time moves on, so
+    percentiles cover between ``window - window / slots`` and ``window`` seconds of traffic.
+    """
+
+    def __init__(self, window=300, slots=5):
+        self.slot_seconds = window / slots
+        self.slots = slots
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def _slot(self, now):
+        return int(now // self.slot_seconds)
+
+    def record(self, route, microseconds, now=None):
+        slot = self._slot(time.time() if now is None else now)
+        with self._lock:
+            history = self._routes.setdefault(route, {})
+            histogram = history.get(slot)
+            if histogram is None:
+                for expired in [key for key in history if key <= slot - self.slots]:
+                    del history[expired]
+                histogram = history[slot] = LatencyHistogram()
+            histogram.record(microseconds)
+
+    def summary(self, now=None):
+        """``{route: {"count", "p50", "p95", "p99", "max"}}`` with latencies in milliseconds."""
+        oldest = self._slot(time.time() if now is None else now) - self.slots + 1
+        with self._lock:
+            merged = {}
+            for route, history in self._routes.items():
+                combined = LatencyHistogram()
+                for slot, histogram in history.items():
+                    if slot >= oldest:
+                        combined.merge(histogram)
+                if combined.total:
+                    merged[route] = combined
+
+        summary = {}
+        for route, histogram in merged.items():
+            p50, p95, p99 = histogram.percentiles(0.5, 0.95, 0.99)
+            summary[route] = {"count": histogram.total, "p50": p50 / 1000.0, "p95": p95 / 1000.0,
+                              "p99": p99 / 1000.0, "max": histogram.max / 1000.0}
+        return summary
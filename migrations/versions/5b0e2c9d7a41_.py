@@ -0,0 +1,26 @@
+"""row versions for venues and artists
+
+Revision ID: 5b0e2c9d7a41
+Revises: 86de63765973
+Create Date: 2026-10-19 10:03:17.204511
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b0e2c9d7a41'
+down_revision = '86de63765973'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('venues', sa.Column('version_id', sa.Integer(), nullable=False, server_default='1'))
+    op.add_column('artists', sa.Column('version_id', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    op.drop_column('artists', 'version_id')
+    op.drop_column('venues', 'version_id')
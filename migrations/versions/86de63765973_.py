@@ -0,0 +1,48 @@
+"""soft delete for venues and artists
+
+Revision ID: 86de63765973
+Revises: 824a52e600ce
+Create Date: 2026-10-19 09:12:41.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '86de63765973'
+down_revision = '824a52e600ce'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('venues', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('artists', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+    # Partial indexes only cover live rows, so deleted entities add nothing to read paths.
+    op.create_index('ix_venues_active_city_state', 'venues', ['city', 'state'], unique=False,
+                    postgresql_where=sa.text('deleted_at IS NULL'), sqlite_where=sa.text('deleted_at IS NULL'))
+    op.create_index('ix_venues_active_name', 'venues', ['name'], unique=False,
+                    postgresql_where=sa.text('deleted_at IS NULL'), sqlite_where=sa.text('deleted_at IS NULL'))
+    op.create_index('ix_venues_deleted_at', 'venues', ['deleted_at'], unique=False,
+                    postgresql_where=sa.text('deleted_at IS NOT NULL'), sqlite_where=sa.text('deleted_at IS NOT NULL'))
+    op.create_index('ix_artists_active_name', 'artists', ['name'], unique=False,
+                    postgresql_where=sa.text('deleted_at IS NULL'), sqlite_where=sa.text('deleted_at IS NULL'))
+    op.create_index('ix_artists_deleted_at', 'artists', ['deleted_at'], unique=False,
+                    postgresql_where=sa.text('deleted_at IS NOT NULL'), sqlite_where=sa.text('deleted_at IS NOT NULL'))
+
+    op.create_index(op.f('ix_shows_venue_id'), 'shows', ['venue_id'], unique=False)
+    op.create_index(op.f('ix_shows_artist_id'), 'shows', ['artist_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_shows_artist_id'), table_name='shows')
+    op.drop_index(op.f('ix_shows_venue_id'), table_name='shows')
+    op.drop_index('ix_artists_deleted_at', table_name='artists')
+    op.drop_index('ix_artists_active_name', table_name='artists')
+    op.drop_index('ix_venues_deleted_at', table_name='venues')
+    op.drop_index('ix_venues_active_name', table_name='venues')
+    op.drop_index('ix_venues_active_city_state', table_name='venues')
+    op.drop_column('artists', 'deleted_at')
+    op.drop_column('venues', 'deleted_at')
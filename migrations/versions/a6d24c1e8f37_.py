@@ -0,0 +1,28 @@
+"""venue shard directory
+
+Revision ID: a6d24c1e8f37
+Revises: 3f8d0a6b92e4
+Create Date: 2026-10-19 16:21:07.118425
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d24c1e8f37'
+down_revision = '3f8d0a6b92e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('venue_shards',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.String(length=32), nullable=False),
+    sa.PrimaryKeyConstraint('venue_id')
+    )
+
+
+def downgrade():
+    op.drop_table('venue_shards')
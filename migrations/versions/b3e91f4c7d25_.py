@@ -0,0 +1,32 @@
+"""change feed positions
+
+Revision ID: b3e91f4c7d25
+Revises: a6d24c1e8f37
+Create Date: 2026-10-19 17:05:41.502913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e91f4c7d25'
+down_revision = 'a6d24c1e8f37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('changes') as batch_op:
+        batch_op.add_column(sa.Column('position', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'),
+                                      nullable=True))
+    # Rows already in the log are committed, so their id order is a valid feed order, and existing
+    # consumer cursors (which were ids) stay valid.
+    op.execute('UPDATE changes SET position = id')
+    op.create_index(op.f('ix_changes_position'), 'changes', ['position'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_changes_position'), table_name='changes')
+    with op.batch_alter_table('changes') as batch_op:
+        batch_op.drop_column('position')
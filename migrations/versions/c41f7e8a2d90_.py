@@ -0,0 +1,34 @@
+"""page view counters
+
+Revision ID: c41f7e8a2d90
+Revises: 5b0e2c9d7a41
+Create Date: 2026-10-19 11:26:05.771940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f7e8a2d90'
+down_revision = '5b0e2c9d7a41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('page_view_counts',
+    sa.Column('entity_type', sa.String(length=16), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('granularity', sa.String(length=8), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('views', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('entity_type', 'entity_id', 'granularity', 'bucket_start')
+    )
+    op.create_index('ix_page_view_counts_granularity_bucket', 'page_view_counts',
+                    ['granularity', 'bucket_start'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_page_view_counts_granularity_bucket', table_name='page_view_counts')
+    op.drop_table('page_view_counts')
@@ -0,0 +1,29 @@
+"""drop shows_history view
+
+Revision ID: d82c5f1a9e63
+Revises: b3e91f4c7d25
+Create Date: 2026-10-19 18:12:07.316428
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd82c5f1a9e63'
+down_revision = 'b3e91f4c7d25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Nothing reads the view: show_history() filters each table before the UNION ALL, and shards
+    # built with create_all never had it.
+    op.execute('DROP VIEW IF EXISTS shows_history')
+
+
+def downgrade():
+    op.execute('CREATE VIEW shows_history AS '
+               'SELECT id, venue_id, artist_id, start_time FROM shows '
+               'UNION ALL '
+               'SELECT id, venue_id, artist_id, start_time FROM shows_archive')
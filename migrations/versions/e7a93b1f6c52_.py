@@ -0,0 +1,111 @@
+"""show archive and monthly partitions
+
+Revision ID: e7a93b1f6c52
+Revises: c41f7e8a2d90
+Create Date: 2026-10-19 13:48:52.906117
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a93b1f6c52'
+down_revision = 'c41f7e8a2d90'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+
+
+def add_months(moment, months):
+    month = moment.month - 1 + months
+    return datetime(moment.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_shows():
+    bind = op.get_bind()
+    first_show = bind.execute(sa.text('SELECT min(start_time) FROM shows')).scalar()
+    this_month = add_months(datetime.now(), 0)
+
+    op.execute('ALTER TABLE shows RENAME TO shows_unpartitioned')
+    op.execute('DROP INDEX ix_shows_venue_id')
+    op.execute('DROP INDEX ix_shows_artist_id')
+    op.execute("""
+        CREATE TABLE shows (
+            id integer NOT NULL DEFAULT nextval('shows_id_seq'),
+            venue_id integer REFERENCES venues (id),
+            artist_id integer REFERENCES artists (id),
+            start_time timestamp without time zone NOT NULL,
+            PRIMARY KEY (id, start_time)
+        ) PARTITION BY RANGE (start_time)
+    """)
+    op.execute('CREATE TABLE shows_default PARTITION OF shows DEFAULT')
+
+    month = add_months(min(first_show, this_month) if first_show else this_month, 0)
+    while month <= add_months(this_month, MONTHS_AHEAD):
+        op.execute("CREATE TABLE shows_p{:%Y_%m} PARTITION OF shows FOR VALUES FROM ('{}') TO ('{}')"
+                   .format(month, month, add_months(month, 1)))
+        month = add_months(month, 1)
+
+    op.execute('INSERT INTO shows (id, venue_id, artist_id, start_time) '
+               'SELECT id, venue_id, artist_id, start_time FROM shows_unpartitioned')
+    op.execute('ALTER SEQUENCE shows_id_seq OWNED BY shows.id')
+    op.execute('DROP TABLE shows_unpartitioned')
+    op.create_index(op.f('ix_shows_venue_id'), 'shows', ['venue_id'], unique=False)
+    op.create_index(op.f('ix_shows_artist_id'), 'shows', ['artist_id'], unique=False)
+
+
+def unpartition_shows():
+    op.execute('ALTER TABLE shows RENAME TO shows_partitioned')
+    op.execute('DROP INDEX ix_shows_venue_id')
+    op.execute('DROP INDEX ix_shows_artist_id')
+    op.execute("""
+        CREATE TABLE shows (
+            id integer NOT NULL DEFAULT nextval('shows_id_seq') PRIMARY KEY,
+            venue_id integer REFERENCES venues (id),
+            artist_id integer REFERENCES artists (id),
+            start_time timestamp without time zone NOT NULL
+        )
+    """)
+    op.execute('INSERT INTO shows (id, venue_id, artist_id, start_time) '
+               'SELECT id, venue_id, artist_id, start_time FROM shows_partitioned')
+    op.execute('ALTER SEQUENCE shows_id_seq OWNED BY shows.id')
+    op.execute('DROP TABLE shows_partitioned')
+    op.create_index(op.f('ix_shows_venue_id'), 'shows', ['venue_id'], unique=False)
+    op.create_index(op.f('ix_shows_artist_id'), 'shows', ['artist_id'], unique=False)
+
+
+def upgrade():
+    op.create_table('shows_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=True),
+    sa.Column('artist_id', sa.Integer(), nullable=True),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['artists.id'], ),
+    sa.ForeignKeyConstraint(['venue_id'], ['venues.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_shows_archive_venue_id'), 'shows_archive', ['venue_id'], unique=False)
+    op.create_index(op.f('ix_shows_archive_artist_id'), 'shows_archive', ['artist_id'], unique=False)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        partition_shows()
+
+    op.execute('CREATE VIEW shows_history AS '
+               'SELECT id, venue_id, artist_id, start_time FROM shows '
+               'UNION ALL '
+               'SELECT id, venue_id, artist_id, start_time FROM shows_archive')
+
+
+def downgrade():
+    op.execute('DROP VIEW shows_history')
+
+    if op.get_bind().dialect.name == 'postgresql':
+        unpartition_shows()
+
+    op.drop_index(op.f('ix_shows_archive_artist_id'), table_name='shows_archive')
+    op.drop_index(op.f('ix_shows_archive_venue_id'), table_name='shows_archive')
+    op.drop_table('shows_archive')
@@ -0,0 +1,27 @@
+"""show id allocator
+
+Revision ID: f4a7c3e1b859
+Revises: d82c5f1a9e63
+Create Date: 2026-10-19 18:40:52.604117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4a7c3e1b859'
+down_revision = 'd82c5f1a9e63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('show_ids',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('show_ids')
@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+
+class MemoryStore(object):
+    """Token buckets held in this process; each worker enforces its own limits."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (burst, now, 0))
+            tokens, retry_after = _refill_and_take(tokens, updated, rate, burst, now)
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return retry_after
+
+    def _prune(self, now):
+        # A bucket that has refilled completely is indistinguishable from a missing one.
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+
+
+class SqliteStore(object):
+    """Token buckets in a local SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path, prune_interval=60):
+        self.path = path
+        self.prune_interval = prune_interval
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS token_buckets (key TEXT PRIMARY KEY, '
+                               'tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_token_buckets_full_at ON token_buckets (full_at)')
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+            self._local.pruned = 0
+        return connection
+
+    def take(self, key, rate, burst, now):
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM token_buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens, retry_after = _refill_and_take(tokens, updated, rate, burst, now)
+            connection.execute('INSERT OR REPLACE INTO token_buckets (key, tokens, updated, full_at) '
+                               'VALUES (?, ?, ?, ?)', (key, tokens, now, now + (burst - tokens) / rate))
+            connection.execute('COMMIT')
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+        if now - self._local.pruned > self.prune_interval:
+            self._prune(connection, now)
+        return retry_after
+
+    def _prune(self, connection, now):
+        # As in MemoryStore, a bucket that has refilled completely is indistinguishable from a missing one.
+        connection.execute('DELETE FROM token_buckets WHERE full_at <= ?', (now,))
+        self._local.pruned = now
+
+
+def _refill_and_take(tokens, updated, rate, burst, now):
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+class RateLimiter(object):
+    """Per-client, per-route token buckets.
+
+    ``limits`` maps an endpoint name to ``(requests_per_second, burst)``; endpoints not listed are
+    never throttled. ``allowed`` and ``limited`` count decisions per endpoint for monitoring.
+    """
+
+    def __init__(self, limits, store=None):
+        self.limits = limits
+        self.store = store or MemoryStore()
+        self.allowed = Counter()
+        self.limited = Counter()
+
+    def check(self, endpoint, client):
+        """Return 0 if the request may proceed, otherwise the seconds until a token is available."""
+        if endpoint not in self.limits:
+            return 0
+        rate, burst = self.limits[endpoint]
+        retry_after = self.store.take('{}:{}'.format(endpoint, client), rate, burst, time.time())
+        if retry_after:
+            self.limited[endpoint] += 1
+        else:
+            self.allowed[endpoint] += 1
+        return retry_after
+
+    def stats(self):
+        return {endpoint: {"allowed": self.allowed[endpoint], "limited": self.limited[endpoint]}
+                for endpoint in self.limits}
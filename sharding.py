@@ -0,0 +1,161 @@
+import itertools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+
+class ShardRouter(object):
+    """Routes venues, and the shows held at them, to per-region databases by the venue's state.
+
+    With no shards configured the router is disabled and every call falls through to the
+    primary ``session``, so callers can be written once for both modes.
+
+    ``execution_options``, if given, is called on the calling thread by ``fan_out`` and the
+    options it returns are set on each shard connection, so per-request settings reach the
+    worker threads.
+    """
+
+    def __init__(self, session, urls, by_state, default=None, query_cls=None, execution_options=None):
+        unknown = (set(by_state.values()) | {default} - {None}) - set(urls) if urls else set()
+        if unknown:
+            raise ValueError('States are mapped to unknown shards: {}'.format(', '.join(sorted(unknown))))
+        self.primary = session
+        self.execution_options = execution_options
+        self.by_state = by_state
+        self.default = default
+        self.engines = {name: create_engine(url) for name, url in urls.items()}
+        options = {'query_cls': query_cls} if query_cls else {}
+        self.sessions = {name: scoped_session(sessionmaker(bind=engine, **options))
+                         for name, engine in self.engines.items()}
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(urls))) if urls else None
+
+    @property
+    def enabled(self):
+        return bool(self.engines)
+
+    def shard_for_state(self, state):
+        """Shard for venues in ``state``; None when sharding is on but the state has no shard."""
+        return self.by_state.get(state, self.default)
+
+    def session(self, name):
+        return self.sessions[name]() if self.enabled else self.primary
+
+    def fan_out(self, fn):
+        """Call ``fn(session)`` on every shard in parallel and return the results in shard order."""
+        if not self.enabled:
+            return [fn(self.primary)]
+        options = self.execution_options() if self.execution_options else {}
+        futures = [self._executor.submit(self._run, name, fn, options) for name in sorted(self.sessions)]
+        return [future.result() for future in futures]
+
+    def _run(self, name, fn, options):
+        session = self.sessions[name]()
+        try:
+            if options:
+                session.connection(execution_options=options)
+            return fn(session)
+        finally:
+            self.sessions[name].remove()
+
+    def stream(self, fn, batch_size, buffer=2):
+        """Iterators over ``fn(session)`` on every shard, in shard order, that are read lazily.
+
+        Each shard is read on its own thread and hands its rows over ``batch_size`` at a time
+        through a queue of at most ``buffer`` batches, so a large result is never held in memory.
+        Call ``close()`` on iterators that are abandoned before the end to stop their threads.
+        Unlike ``fan_out`` this needs shards: unsharded, read the primary's query directly.
+        """
+        options = self.execution_options() if self.execution_options else {}
+
+        def batches(name):
+            session = self.sessions[name]()
+            try:
+                if options:
+                    session.connection(execution_options=options)
+                rows = iter(fn(session))
+                for batch in iter(lambda: list(itertools.islice(rows, batch_size)), []):
+                    yield batch
+            finally:
+                self.sessions[name].remove()
+
+        return [ShardStream(batches(name), buffer) for name in sorted(self.sessions)]
+
+    def replicate(self, table, row):
+        """Upsert ``row`` into ``table`` on every shard (reference data such as artists)."""
+        def upsert(session):
+            updated = session.execute(table.update().where(table.c.id == row['id']).values(row)).rowcount
+            if not updated:
+                session.execute(table.insert().values(row))
+            session.commit()
+
+        if self.enabled:
+            self.fan_out(upsert)
+
+    def create_all(self, metadata):
+        for engine in self.engines.values():
+            metadata.create_all(engine)
+
+    def remove(self):
+        for session in self.sessions.values():
+            session.remove()
+
+
+class ShardStream(object):
+    """Iterator over rows that a worker thread produces, in batches, from ``batches``."""
+
+    _DONE = object()
+
+    def __init__(self, batches, buffer):
+        self._queue = queue.Queue(buffer)
+        self._stop = threading.Event()
+        self._batch = iter(())
+        self._finished = False
+        threading.Thread(target=self._produce, args=(batches,), daemon=True).start()
+
+    def _put(self, item):
+        # Gives up once the reader has closed the stream, so an abandoned thread does not block forever.
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, batches):
+        # The generator is closed here, on the thread that opened its session.
+        try:
+            for batch in batches:
+                if not self._put(batch):
+                    return
+        except Exception as error:
+            self._put(error)
+            return
+        finally:
+            batches.close()
+        self._put(self._DONE)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for row in self._batch:
+            return row
+        while not self._finished:
+            item = self._queue.get()
+            if item is self._DONE:
+                self._finished = True
+            elif isinstance(item, Exception):
+                self._finished = True
+                raise item
+            else:
+                self._batch = iter(item)
+                for row in self._batch:
+                    return row
+        raise StopIteration
+
+    def close(self):
+        self._stop.set()
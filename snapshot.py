@@ -0,0 +1,201 @@
+import csv
+import gzip
+import io
+import itertools
+import json
+import pickle
+import random
+from datetime import timedelta
+
+from forms import Genre, UnitedState
+
+FORMAT_VERSION = 1
+
+# A few real cities per state, largest first; earlier cities get more venues and artists.
+CITIES = {
+    'AL': ['Birmingham', 'Montgomery', 'Huntsville'], 'AK': ['Anchorage', 'Fairbanks', 'Juneau'],
+    'AZ': ['Phoenix', 'Tucson', 'Flagstaff'], 'AR': ['Little Rock', 'Fayetteville', 'Fort Smith'],
+    'CA': ['Los Angeles', 'San Francisco', 'San Diego', 'Oakland', 'Sacramento'],
+    'CO': ['Denver', 'Boulder', 'Colorado Springs'], 'CT': ['Hartford', 'New Haven', 'Stamford'],
+    'DE': ['Wilmington', 'Dover', 'Newark'], 'FL': ['Miami', 'Orlando', 'Tampa', 'Jacksonville'],
+    'GA': ['Atlanta', 'Athens', 'Savannah'], 'HI': ['Honolulu', 'Hilo', 'Kailua'],
+    'ID': ['Boise', 'Idaho Falls', 'Moscow'], 'IL': ['Chicago', 'Springfield', 'Champaign'],
+    'IN': ['Indianapolis', 'Bloomington', 'Fort Wayne'], 'IA': ['Des Moines', 'Iowa City', 'Cedar Rapids'],
+    'KS': ['Wichita', 'Lawrence', 'Kansas City'], 'KY': ['Louisville', 'Lexington', 'Bowling Green'],
+    'LA': ['New Orleans', 'Baton Rouge', 'Lafayette'], 'ME': ['Portland', 'Bangor', 'Lewiston'],
+    'MD': ['Baltimore', 'Annapolis', 'Silver Spring'], 'MA': ['Boston', 'Cambridge', 'Worcester'],
+    'MI': ['Detroit', 'Ann Arbor', 'Grand Rapids'], 'MN': ['Minneapolis', 'Saint Paul', 'Duluth'],
+    'MS': ['Jackson', 'Oxford', 'Hattiesburg'], 'MO': ['Kansas City', 'St. Louis', 'Columbia'],
+    'MT': ['Missoula', 'Billings', 'Bozeman'], 'NE': ['Omaha', 'Lincoln', 'Grand Island'],
+    'NV': ['Las Vegas', 'Reno', 'Henderson'], 'NH': ['Manchester', 'Portsmouth', 'Concord'],
+    'NJ': ['Newark', 'Jersey City', 'Asbury Park'], 'NM': ['Albuquerque', 'Santa Fe', 'Las Cruces'],
+    'NY': ['New York', 'Brooklyn', 'Buffalo', 'Rochester'], 'NC': ['Charlotte', 'Raleigh', 'Asheville'],
+    'ND': ['Fargo', 'Bismarck', 'Grand Forks'], 'OH': ['Columbus', 'Cleveland', 'Cincinnati'],
+    'OK': ['Oklahoma City', 'Tulsa', 'Norman'], 'OR': ['Portland', 'Eugene', 'Bend'],
+    'PA': ['Philadelphia', 'Pittsburgh', 'Harrisburg'], 'RI': ['Providence', 'Newport', 'Warwick'],
+    'SC': ['Charleston', 'Columbia', 'Greenville'], 'SD': ['Sioux Falls', 'Rapid City', 'Brookings'],
+    'TN': ['Nashville', 'Memphis', 'Knoxville'], 'TX': ['Austin', 'Houston', 'Dallas', 'San Antonio'],
+    'UT': ['Salt Lake City', 'Provo', 'Ogden'], 'VT': ['Burlington', 'Montpelier', 'Brattleboro'],
+    'VA': ['Richmond', 'Norfolk', 'Charlottesville'], 'WA': ['Seattle', 'Spokane', 'Tacoma'],
+    'WV': ['Charleston', 'Morgantown', 'Huntington'], 'WI': ['Milwaukee', 'Madison', 'Green Bay'],
+    'WY': ['Cheyenne', 'Casper', 'Laramie'],
+}
+
+VENUE_WORDS = ['Blue', 'Velvet', 'Golden', 'Iron', 'Neon', 'Silver', 'Crimson', 'Echo', 'Copper', 'Lucky',
+               'Midnight', 'Paper', 'Rusty', 'Wild', 'Hollow', 'Electric', 'Little', 'Grand', 'Red', 'Old']
+VENUE_PLACES = ['Room', 'Hall', 'Lounge', 'Tavern', 'Ballroom', 'Theatre', 'Club', 'Garage', 'Cellar',
+                'Warehouse', 'Saloon', 'Pavilion', 'Social', 'Basement', 'Music Hall']
+ARTIST_WORDS = ['Static', 'Howling', 'Quiet', 'Burning', 'Lonesome', 'Velvet', 'Dusty', 'Broken', 'Golden',
+                'Paper', 'Lunar', 'Crooked', 'Electric', 'Gentle', 'Savage', 'Hollow', 'Northern', 'Pale']
+ARTIST_NOUNS = ['Wolves', 'Tigers', 'Saints', 'Ghosts', 'Rivers', 'Machines', 'Sparrows', 'Kings', 'Orchids',
+                'Pilots', 'Lanterns', 'Horses', 'Strangers', 'Comets', 'Daughters', 'Brothers', 'Echoes']
+FIRST_NAMES = ['Ada', 'Miles', 'Nina', 'Otis', 'Etta', 'Louis', 'Billie', 'Ray', 'Aretha', 'Johnny', 'Patti',
+               'Chet', 'Ella', 'Hank', 'Joni', 'Marvin', 'Odetta', 'Sam', 'Tina', 'Woody']
+LAST_NAMES = ['Parker', 'Reed', 'Holiday', 'James', 'Cash', 'Simone', 'Baker', 'Waters', 'Franklin', 'King',
+              'Mitchell', 'Gaye', 'Turner', 'Guthrie', 'Smith', 'Redding', 'Cooke', 'Davis', 'Carter', 'Young']
+
+GENRES = [genre.value for genre in Genre]
+
+VENUE_COLUMNS = ['id', 'name', 'genres', 'city', 'state', 'address', 'phone', 'seeking_talent',
+                 'seeking_description', 'image_link', 'website', 'facebook_link', 'version_id']
+ARTIST_COLUMNS = ['id', 'name', 'city', 'state', 'phone', 'genres', 'seeking_venue', 'seeking_description',
+                  'image_link', 'website', 'facebook_link', 'version_id']
+# Shows store start_time as minutes relative to the moment the snapshot is loaded.
+SHOW_COLUMNS = ['id', 'venue_id', 'artist_id', 'start_offset']
+
+# Shows are spread over the past year and the next six months, starting 6pm-11:30pm.
+PAST_DAYS = 365
+FUTURE_DAYS = 180
+
+
+def _phone(rng):
+    return '{}{:03d}{:04d}'.format(rng.randint(201, 989), rng.randint(0, 999), rng.randint(0, 9999))
+
+
+def _slug(name):
+    return ''.join(c if c.isalnum() else '-' for c in name.lower()).strip('-')
+
+
+def generate(seed, venues, artists, shows):
+    """Build a synthetic dataset; the same arguments always produce the same rows.
+
+    Cities within a state and artists' popularity follow a Zipf distribution, and shows per venue
+    a Pareto one, so a few venues and artists carry most of the shows the way real listings do.
+    Returns ``{table: (columns, rows)}``.
+    """
+    rng = random.Random(seed)
+    cities = [(state.name, city) for state in UnitedState for city in CITIES[state.name]]
+    city_weights = [1 / rank for state in UnitedState for rank in range(1, len(CITIES[state.name]) + 1)]
+
+    venue_rows = []
+    for venue_id in range(1, venues + 1):
+        state, city = rng.choices(cities, city_weights)[0]
+        name = 'The {} {}'.format(rng.choice(VENUE_WORDS), rng.choice(VENUE_PLACES))
+        genres = rng.sample(GENRES, rng.randint(1, 3))
+        seeking = rng.random() < 0.3
+        venue_rows.append([
+            venue_id, name, genres, city, state,
+            '{} {} St'.format(rng.randint(1, 2999), rng.choice(LAST_NAMES)), _phone(rng),
+            seeking, 'Booking {} acts for weeknights.'.format(genres[0]) if seeking else None,
+            'https://picsum.photos/seed/venue{}/600/400'.format(venue_id),
+            'https://{}.example.com'.format(_slug(name)),
+            'https://www.facebook.com/{}'.format(_slug(name)), 1,
+        ])
+
+    artist_rows = []
+    for artist_id in range(1, artists + 1):
+        state, city = rng.choices(cities, city_weights)[0]
+        if rng.random() < 0.6:
+            name = 'The {} {}'.format(rng.choice(ARTIST_WORDS), rng.choice(ARTIST_NOUNS))
+        else:
+            name = '{} {}'.format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+        seeking = rng.random() < 0.4
+        artist_rows.append([
+            artist_id, name, city, state, _phone(rng), ','.join(rng.sample(GENRES, rng.randint(1, 2))),
+            seeking, 'Looking for weekend residencies in {}.'.format(city) if seeking else None,
+            'https://picsum.photos/seed/artist{}/600/400'.format(artist_id),
+            'https://{}.example.com'.format(_slug(name)),
+            'https://www.facebook.com/{}'.format(_slug(name)), 1,
+        ])
+
+    venue_weights = list(itertools.accumulate(rng.paretovariate(2.0) for _ in range(venues)))
+    artist_order = list(range(1, artists + 1))
+    rng.shuffle(artist_order)
+    artist_weights = list(itertools.accumulate(1 / rank ** 0.8 for rank in range(1, artists + 1)))
+
+    show_rows = []
+    for show_id in range(1, shows + 1):
+        venue_id = rng.choices(range(1, venues + 1), cum_weights=venue_weights)[0]
+        artist_id = rng.choices(artist_order, cum_weights=artist_weights)[0]
+        day = rng.randint(-PAST_DAYS, FUTURE_DAYS)
+        show_rows.append([show_id, venue_id, artist_id, day * 24 * 60 + 18 * 60 + rng.randrange(12) * 30])
+
+    return {
+        'venues': (VENUE_COLUMNS, venue_rows),
+        'artists': (ARTIST_COLUMNS, artist_rows),
+        'shows': (SHOW_COLUMNS, show_rows),
+    }
+
+
+def write(path, tables, **meta):
+    """Write ``tables`` as gzip-compressed JSON lines: a header, then one line per row."""
+    # Tables are listed in load order, parents before the shows that reference them.
+    header = dict(meta, format=FORMAT_VERSION,
+                  tables=[{'name': name, 'columns': columns, 'rows': len(rows)}
+                          for name, (columns, rows) in tables.items()])
+    # No name or mtime in the gzip header keeps the file byte-for-byte reproducible for a given seed.
+    with open(path, 'wb') as raw, gzip.GzipFile(filename='', fileobj=raw, mode='wb', mtime=0) as f:
+        f.write((json.dumps(header, sort_keys=True) + '\n').encode('utf-8'))
+        for columns, rows in tables.values():
+            for row in rows:
+                f.write((json.dumps(row, separators=(',', ':')) + '\n').encode('utf-8'))
+
+
+def read(path):
+    """Return the snapshot header and ``{table: rows}``, in load order."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('format') != FORMAT_VERSION:
+            raise ValueError('unsupported snapshot format {!r}'.format(header.get('format')))
+        tables = {table['name']: [json.loads(f.readline()) for _ in range(table['rows'])]
+                  for table in header['tables']}
+    return header, tables
+
+
+def prepare(header, tables, now):
+    """Return ``{table: (columns, rows)}`` ready to insert, in load order.
+
+    Show offsets become start times around ``now``, so upcoming shows stay upcoming however old
+    the snapshot file is.
+    """
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    prepared = {}
+    for table in header['tables']:
+        columns, rows = table['columns'], tables[table['name']]
+        if 'start_offset' in columns:
+            index = columns.index('start_offset')
+            columns = columns[:index] + ['start_time'] + columns[index + 1:]
+            rows = [row[:index] + [today + timedelta(minutes=row[index])] + row[index + 1:] for row in rows]
+        prepared[table['name']] = (columns, rows)
+    return prepared
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Stream ``rows`` into ``table`` with PostgreSQL's COPY, a single round trip per table."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_copy_value(value) for value in row])
+    buffer.seek(0)
+    cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(table, ', '.join(columns)), buffer)
+
+
+def _copy_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        # Venue.genres is a PickleType (bytea) column.
+        return '\\x' + pickle.dumps(value).hex()
+    return value
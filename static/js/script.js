@@ -2,3 +2,55 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Selects with a data-lookup URL (the show form's artist and venue) load their options page
+// by page from /api/lookup/<kind>, filtered by the search box that names them.
+document.querySelectorAll('select[data-lookup]').forEach(function (select) {
+  var search = document.querySelector('.lookup-search[data-lookup-for="' + select.id + '"]');
+  var more = document.querySelector('.lookup-more[data-lookup-for="' + select.id + '"]');
+  var query = '';
+  var page = 1;
+  var timer = null;
+
+  function load(reset) {
+    var url = select.getAttribute('data-lookup') + '?q=' + encodeURIComponent(query) + '&page=' + page;
+    fetch(url).then(function (response) {
+      return response.json();
+    }).then(function (data) {
+      var selected = select.value;
+      if (reset) {
+        Array.prototype.slice.call(select.options).forEach(function (option) {
+          if (!option.selected) {
+            select.removeChild(option);
+          }
+        });
+      }
+      data.results.forEach(function (item) {
+        if (String(item.id) !== selected) {
+          select.add(new Option(item.name + ' (#' + item.id + ')', item.id));
+        }
+      });
+      if (more) {
+        more.hidden = !data.has_more;
+      }
+    });
+  }
+
+  if (search) {
+    search.addEventListener('input', function () {
+      clearTimeout(timer);
+      timer = setTimeout(function () {
+        query = search.value.trim();
+        page = 1;
+        load(true);
+      }, 250);
+    });
+  }
+  if (more) {
+    more.addEventListener('click', function () {
+      page += 1;
+      load(false);
+    });
+  }
+  load(false);
+});
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import config
+
+TEMP_DIR = tempfile.mkdtemp()
+config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(TEMP_DIR, 'fyyur.db')
+config.ACCESS_LOG = None
+config.SLOW_REQUEST_LOG = None
+
+import app as fyyur  # noqa: E402 (the config above has to be in place first)
+from loadshed import ConcurrencyLimiter  # noqa: E402
+
+STALE_BANNER = b"We can't reach the database right now"
+
+
+class ConcurrencyLimiterTestCase(unittest.TestCase):
+
+    def test_admits_up_to_limit(self):
+        limiter = ConcurrencyLimiter(2)
+        self.assertTrue(limiter.try_acquire())
+        self.assertTrue(limiter.try_acquire())
+        self.assertFalse(limiter.try_acquire())
+        self.assertEqual(limiter.stats(), {"limit": 2, "in_flight": 2, "shed": 1})
+
+    def test_release_frees_a_slot(self):
+        limiter = ConcurrencyLimiter(1)
+        self.assertTrue(limiter.try_acquire())
+        limiter.release()
+        self.assertTrue(limiter.try_acquire())
+        self.assertEqual(limiter.stats()["shed"], 0)
+
+
+class LoadSheddingTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        fyyur.app.config['TESTING'] = True
+        with fyyur.app.app_context():
+            fyyur.db.create_all()
+            fyyur.db.session.add(fyyur.Venue(name='The Musical Hop', city='San Francisco', state='CA',
+                                             address='1015 Folsom Street', genres='Jazz'))
+            fyyur.db.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        fyyur.page_views.flush()
+        with fyyur.app.app_context():
+            fyyur.db.session.remove()
+            fyyur.db.drop_all()
+        shutil.rmtree(TEMP_DIR, ignore_errors=True)
+
+    def setUp(self):
+        self.client = fyyur.app.test_client()
+        self.config = {key: fyyur.app.config[key]
+                       for key in ('DB_INJECTED_LATENCY', 'STATEMENT_TIMEOUTS', 'CHANGE_STREAM_MAX_SECONDS',
+                                    'CHANGE_STREAM_POLL_INTERVAL')}
+        self.limits = (fyyur.in_flight.limit, fyyur.open_streams.limit)
+        fyyur.stale_listings.clear()
+
+    def tearDown(self):
+        fyyur.app.config.update(self.config)
+        fyyur.in_flight.limit, fyyur.open_streams.limit = self.limits
+
+    def slow_database(self, endpoint):
+        fyyur.app.config['STATEMENT_TIMEOUTS'] = dict(self.config['STATEMENT_TIMEOUTS'], **{endpoint: 10})
+        fyyur.app.config['DB_INJECTED_LATENCY'] = 50
+
+    def test_sheds_requests_beyond_limit(self):
+        fyyur.in_flight.limit = 0
+        response = self.client.get('/venues/1')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+    def test_releases_slot_after_request(self):
+        self.assertEqual(self.client.get('/venues/1').status_code, 200)
+        self.assertEqual(fyyur.in_flight.in_flight, 0)
+
+    def test_change_streams_have_their_own_slots(self):
+        fyyur.open_streams.limit = 0
+        self.assertEqual(self.client.get('/api/changes/stream').status_code, 503)
+        self.assertEqual(self.client.get('/venues/1').status_code, 200)
+
+    def test_change_stream_releases_slot_when_it_ends(self):
+        fyyur.app.config['CHANGE_STREAM_MAX_SECONDS'] = 0.2
+        fyyur.app.config['CHANGE_STREAM_POLL_INTERVAL'] = 0.05
+        response = self.client.get('/api/changes/stream', buffered=False)
+        self.assertEqual(fyyur.open_streams.in_flight, 1)
+        self.assertEqual(fyyur.in_flight.in_flight, 0)
+        self.assertIn(b': keepalive', response.get_data())
+        response.close()
+        self.assertEqual(fyyur.open_streams.in_flight, 0)
+        self.assertEqual(fyyur.in_flight.in_flight, 0)
+
+    def test_statement_timeout_returns_503(self):
+        self.slow_database('show_venue')
+        response = self.client.get('/venues/1')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '5')
+
+    def test_latency_below_timeout_is_served(self):
+        fyyur.app.config['DB_INJECTED_LATENCY'] = 1
+        self.assertEqual(self.client.get('/venues/1').status_code, 200)
+
+    def test_stale_listing_served_when_database_times_out(self):
+        response = self.client.get('/venues')
+        self.assertIn(b'The Musical Hop', response.data)
+        self.assertNotIn(STALE_BANNER, response.data)
+
+        self.slow_database('venues')
+        response = self.client.get('/venues')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'The Musical Hop', response.data)
+        self.assertIn(STALE_BANNER, response.data)
+
+    def test_listing_without_stale_copy_returns_503(self):
+        self.slow_database('venues')
+        self.assertEqual(self.client.get('/venues').status_code, 503)
+
+
+if __name__ == '__main__':
+    unittest.main()